@@ -0,0 +1,214 @@
+"""
+The challenge.py helpers, but async: requests go out concurrently (up to a
+limit) instead of one round trip at a time.
+Uses httpx if it's installed, otherwise plain urllib in worker threads.
+
+Running this file benchmarks it against the sync client in challenge.py,
+using a throwaway local uvicorn running server/main.py:
+
+    python async_challenge.py [number of users] [concurrency]
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from challenge import URL, UserClient
+
+
+class AsyncUserClient:
+    """
+    This guy talks to the user API without waiting on each request
+    No more than concurrency requests are in flight at once, so fanning out
+    thousands of calls doesn't swamp the server
+    """
+
+    def __init__(self, url=URL, concurrency=20, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+        if httpx is not None:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            self._client = httpx.AsyncClient(timeout=timeout, limits=limits)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def request(self, method, path, params=None, body=None):
+        """
+        It sends one request and returns (status code, headers, json respoing)
+        Params that are None get left out, same as requests does
+        """
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        async with self.semaphore:
+            if self._client is not None:
+                r = await self._client.request(method, f'{self.url}{path}', params=params, json=body)
+                return r.status_code, r.headers, r.json()
+            return await asyncio.to_thread(self._urllib_request, method, path, params, body)
+
+    def _urllib_request(self, method, path, params, body):
+        url = f'{self.url}{path}?{urllib.parse.urlencode(params)}'
+        data = None if body is None else json.dumps(body).encode()
+        r = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(r, timeout=self.timeout) as response:
+                return response.status, response.headers, json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.headers, json.loads(exc.read() or b'null')
+
+    async def docs(self):
+        _, _, data = await self.request('GET', '/docs')
+        return data
+
+    async def get(self, limit=0):
+        _, _, data = await self.request('GET', '/users/get', params={'limit': limit})
+        return data
+
+    async def iter_users(self, page_size=100):
+        """
+        This guy yields every user, fetching a page at a time using the
+        cursor the server hands back
+        """
+        params = {'limit': page_size}
+        while True:
+            _, headers, page = await self.request('GET', '/users/get', params=params)
+            for user in page:
+                yield user
+            cursor = headers.get('X-Next-Cursor')
+            if not cursor:
+                return
+            params['cursor'] = cursor
+
+    async def get_by_attr(self, name=None, id=None, email=None, address=None, phone=None):
+        attr = {'user_name': name, 'user_id': id, 'user_address': address, 'user_email': email, 'user_phone': phone}
+        _, _, data = await self.request('GET', '/user/get', params=attr)
+        return data
+
+    async def add_user(self, name, email=None, phone=None, address=None):
+        attr = {'name': name, 'email': email, 'phone': phone, 'address': address}
+        _, _, data = await self.request('POST', '/users/add', params=attr)
+        return data
+
+    async def update(self, id, name=None, email=None, phone=None, address=None):
+        attr = {'user_name': name, 'user_id': id, 'user_address': address, 'user_email': email, 'user_phone': phone}
+        _, _, data = await self.request('PATCH', '/user/update', params=attr)
+        return data
+
+    async def upsert(self, name, email=None, phone=None, address=None, id=None, update_existing=True):
+        attr = {'name': name, 'email': email, 'phone': phone, 'address': address, 'user_id': id, 'update_existing': update_existing}
+        _, _, data = await self.request('PUT', '/users/upsert', params=attr)
+        return data
+
+    async def delete_user(self, id):
+        status, _, _ = await self.request('DELETE', '/user/delete', params={'user_id': id})
+        return status
+
+    async def add_users(self, users):
+        """
+        It adds every user dict (name, email, phone, address) concurrently
+        It returns the respoings in the same order
+        """
+        return await asyncio.gather(*(self.add_user(**user) for user in users))
+
+    async def update_users(self, updates):
+        """
+        It applies every update dict (id plus the fields to change) concurrently
+        """
+        return await asyncio.gather(*(self.update(**update) for update in updates))
+
+    async def delete_users(self, ids):
+        """
+        It makes a bunch of men go away concurrently and returns each status code
+        """
+        return await asyncio.gather(*(self.delete_user(id) for id in ids))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir):
+    """
+    It starts server/main.py under uvicorn in workdir (so users.txt lands
+    there) and waits for it to answer. It returns (process, api url)
+    """
+    port = free_port()
+    server_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', '--app-dir', server_dir, '--port', str(port), '--log-level', 'warning', 'main:app'],
+        cwd=workdir,
+    )
+    url = f'http://127.0.0.1:{port}/api'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'{url}/docs', timeout=1).close()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('server never came up')
+
+
+def timed(label, count, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<28} {elapsed:>8.2f}s {count / elapsed:>10.0f} req/s')
+    return result
+
+
+async def run_async(url, users, concurrency):
+    async with AsyncUserClient(url, concurrency=concurrency) as client:
+        start = time.perf_counter()
+        await client.add_users(users)
+        added = time.perf_counter() - start
+        ids = [user['id'] async for user in client.iter_users(page_size=500)][:len(users)]
+        start = time.perf_counter()
+        await asyncio.gather(*(client.get_by_attr(id=id) for id in ids))
+        fetched = time.perf_counter() - start
+        return added, fetched
+
+
+def benchmark(count=1000, concurrency=20):
+    users = [{'name': f'User {i}', 'email': f'user{i}@example.com'} for i in range(count)]
+    print(f'{count} users, async concurrency {concurrency}, http client: {"httpx" if httpx else "urllib"}')
+    with tempfile.TemporaryDirectory() as workdir:
+        process, url = start_server(workdir)
+        try:
+            with UserClient(url) as client:
+                timed('sync add_user', count, lambda: [client.add_user(**user) for user in users])
+                ids = [user['id'] for user in client.iter_users(page_size=500)][:count]
+                timed('sync get_by_attr', count, client.get_by_ids, ids)
+            added, fetched = asyncio.run(run_async(url, users, concurrency))
+            print(f'{"async add_users":<28} {added:>8.2f}s {count / added:>10.0f} req/s')
+            print(f'{"async get_by_attr":<28} {fetched:>8.2f}s {count / fetched:>10.0f} req/s')
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
@@ -1,17 +1,248 @@
 import requests
+import copy
 import json
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 URL = 'http://192.168.68.59:8000/api'
 
 
+class ResponseCache:
+    """
+    This guy remembers GET respoings, keyed by path and query params
+    It holds at most size of them, throwing out the least recently used one
+    when it's full, and an entry is only fresh for ttl seconds
+    A stale entry is kept with its ETag so the client can ask the server
+    if it changed instead of downloading it all again
+    """
+
+    def __init__(self, size=1024, ttl=10):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> [expires at, etag, params, data]
+
+    @staticmethod
+    def key(path, params):
+        return path, tuple(sorted((k, v) for k, v in params.items() if v is not None))
+
+    def get(self, key):
+        """
+        It returns the entry for key (fresh or not) or None
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, etag, params, data):
+        self.entries[key] = [time.monotonic() + self.ttl, etag, params, data]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def refresh(self, key):
+        """
+        The server said the entry hasn't changed, so it's good for another ttl
+        """
+        self.entries[key][0] = time.monotonic() + self.ttl
+
+    def invalidate(self, id=None, values=()):
+        """
+        It throws out every entry a change to the user with this id could have made wrong:
+        the user lists, errors (the user might exist now), anything about this id,
+        and anything looked up by one of the changed values
+        """
+        values = {v for v in values if v is not None}
+        for key, (_, _, params, data) in list(self.entries.items()):
+            path, _ = key
+            if (
+                path != '/user/get'
+                or not isinstance(data, dict)
+                or 'error' in data
+                or (id is not None and (data.get('id') == id or params.get('user_id') == id))
+                or values.intersection(params.values())
+            ):
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class UserClient:
+    """
+    This guy talks to the user API for all the funtions below
+    It keeps one requests.Session, so every call reuses a pooled keep-alive
+    connection instead of doing a whole new TCP handshake
+    Every call has a timeout, and failed connections and 5xx responses on
+    GET/PUT/DELETE get retried with backoff
+    Pass cache_size (say 1024) and lookups (get and get_by_attr) get cached
+    for cache_ttl seconds, up to cache_size of them, then revalidated with
+    the ETag the server gave us
+    Our own changes throw out the cached lookups they touch, but other
+    clients' changes can take up to cache_ttl to show up, so it's off by default
+    """
+
+    def __init__(self, url=URL, timeout=(3.05, 30), retries=3, backoff=0.3, pool_size=10, cache_size=0, cache_ttl=10):
+        self.url = url
+        self.timeout = timeout
+        self.cache = ResponseCache(cache_size, cache_ttl) if cache_size else None
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, f'{self.url}{path}', **kwargs)
+
+    def cached_get(self, path, params):
+        """
+        It GETs path and returns the json, from the cache if we have it fresh
+        If we have it stale, we send its ETag and the server answers 304 if it's the same
+        What comes out of the cache is a copy, so changing it doesn't change the cache
+        """
+        if self.cache is None:
+            return self.request('GET', path, params=params).json()
+        key = self.cache.key(path, params)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return copy.deepcopy(entry[3])
+        headers = {'If-None-Match': entry[1]} if entry is not None and entry[1] else {}
+        r = self.request('GET', path, params=params, headers=headers)
+        if r.status_code == 304:
+            self.cache.refresh(key)
+            return copy.deepcopy(entry[3])
+        data = r.json()
+        if r.ok:
+            self.cache.put(key, r.headers.get('ETag'), dict(params), copy.deepcopy(data))
+        return data
+
+    def invalidate(self, id=None, values=()):
+        if self.cache is not None:
+            self.cache.invalidate(id, values)
+
+    def docs(self):
+        """
+        It returns the dox as an array of dicts
+        """
+        return self.request('GET', '/docs').json()
+
+    def get(self, limit=0):
+        """
+        It returns all users (or the first limit of them) as an array of dicts
+        """
+        return self.cached_get('/users/get', {'limit': limit})
+
+    def iter_users(self, page_size=100):
+        """
+        This guy walks every user a page at a time using the cursor the
+        server hands back, so we never ask for the whole database at once
+        It yields dicts
+        """
+        params = {'limit': page_size}
+        while True:
+            r = self.request('GET', '/users/get', params=params)
+            yield from r.json()
+            cursor = r.headers.get('X-Next-Cursor')
+            if not cursor:
+                return
+            params['cursor'] = cursor
+
+    def get_by_attr(self, name=None, id=None, email=None, address=None, phone=None):
+        """
+        It returns the user that matches the attributes as a dict
+        """
+        attr = {'user_name': name, 'user_id': id, 'user_address': address, 'user_email': email, 'user_phone': phone}
+        return self.cached_get('/user/get', attr)
+
+    def add_user(self, name, email=None, phone=None, address=None):
+        """
+        It adds a user and returns the respoing from server (josh)
+        """
+        attr = {'name': name, 'email': email, 'phone': phone, 'address': address}
+        self.invalidate(values=attr.values())
+        return self.request('POST', '/users/add', params=attr).json()
+
+    def update(self, id, name=None, email=None, phone=None, address=None):
+        """
+        It changes the fields that aren't None on the user with this id
+        The server only touches those fields, all in one request, so nobody
+        else's change gets clobbered in between
+        It returns the respoing from server
+        """
+        attr = {'user_name': name, 'user_id': id, 'user_address': address, 'user_email': email, 'user_phone': phone}
+        self.invalidate(id, (name, email, phone, address))
+        return self.request('PATCH', '/user/update', params=attr).json()
+
+    def upsert(self, name, email=None, phone=None, address=None, id=None, update_existing=True):
+        """
+        It updates the user with this id (or this name, if no id) or makes
+        them if they aren't there, in one request
+        With update_existing=False a user that's already there is left alone
+        It returns the respoing from server: {'created': bool, 'user': the guy}
+        """
+        attr = {'name': name, 'email': email, 'phone': phone, 'address': address, 'user_id': id, 'update_existing': update_existing}
+        response = self.request('PUT', '/users/upsert', params=attr).json()
+        user = response.get('user') or {}
+        self.invalidate(user.get('id', id), (name, email, phone, address))
+        return response
+
+    def delete_user(self, id):
+        """
+        It makes a man go away and returns the status code
+        """
+        self.invalidate(id)
+        return self.request('DELETE', '/user/delete', params={'user_id': id}).status_code
+
+    def add_users(self, users):
+        """
+        This adds a whole list of users (dicts with name, email, phone, address) in one request
+        It returns the respoing from server, with the new ids in the same order
+        """
+        users = list(users)
+        for user in users:
+            self.invalidate(user.get('id'), user.values())
+        return self.request('POST', '/users/bulk', json=users).json()
+
+    def get_by_ids(self, ids):
+        """
+        It returns the user dict for each id, in order, reusing the one connection
+        """
+        return [self.get_by_attr(id=id) for id in ids]
+
+    def delete_users(self, ids):
+        """
+        It makes a bunch of men go away and returns each status code, in order
+        """
+        return [self.delete_user(id) for id in ids]
+
+
+client = UserClient()
+
 
 def docs():
     """
     This function retrieves the dox from Vidovich's code challenge
     It prints an array of dicts
     """
-    r = requests.get(f'{URL}/docs')
-    print(json.dumps(r.json()))
+    print(json.dumps(client.docs()))
 
 def get():
     """
@@ -19,8 +250,7 @@ def get():
     It prints an array of dicts
     """
 
-    r = requests.get(f'{URL}/users/get')
-    print(json.dumps(r.json()))
+    print(json.dumps(client.get()))
 
 def get_by_attr(name=None, id=None, email=None, address=None, phone=None):
     """
@@ -28,9 +258,7 @@ def get_by_attr(name=None, id=None, email=None, address=None, phone=None):
     It returns a dict
     """
 
-    attr = {'user_name': name, 'user_id': id, 'user_address': address, 'user_email': email, 'user_phone': phone}
-    r = requests.get(f'{URL}/user/get', params=attr)
-    return r.json()
+    return client.get_by_attr(name=name, id=id, email=email, address=address, phone=phone)
 
 
 def add_user(name, email=None, phone=None, address=None):
@@ -40,43 +268,25 @@ def add_user(name, email=None, phone=None, address=None):
     It printds the respoing from server (josh)
     """
 
-    attr = {'name': name, 'email': email, 'phone': phone, 'address': address}
-
-    r = requests.post(f'{URL}/users/add', params = attr)
-    print(json.dumps(r.json()))
+    print(json.dumps(client.add_user(name, email, phone, address)))
 
-# A func that attempts to make user, but if the user wth the requested name exists we throw a ValueError
+# A func that makes a user, but if the user wth the requested name exists we leave them be
 
 def create_if_not_exists(name, email=None, phone=None, address=None):
     """
     Thus funtion create user if not there
     otherwise it there
+    The server checks and creates in one go, so two of these can't both make the guy
     It print the guy
     """
-    response = get_by_attr(name, email, phone, address)
-
-    if response.get('error'):
-        add_user(name, email, phone, address)
-    else:
-        print(response)
+    print(json.dumps(client.upsert(name, email, phone, address, update_existing=False)))
 
 def update(id, name=None, email=None, phone=None, address=None):
     """
     This guy make a change to a guy that already there, but maybe? need make a change
     It dont return or print nothin, but it can ;))
     """
-    user = get_by_attr(id=id)
-    if name is not None:
-        user['name'] = name
-    if email is not None:
-        user['email'] = email
-    if phone is not None:
-        user['phone'] = phone
-    if address is not None:
-        user['address'] = address
-
-    attr = {'user_name': user['name'], 'user_id': id, 'user_address': user['address'], 'user_email': user['email'], 'user_phone': user['phone']}
-    r = requests.post(f'{URL}/user/update', params=attr)
+    client.update(id, name, email, phone, address)
 
 def delete_user(id):
     """
@@ -84,7 +294,24 @@ def delete_user(id):
     It print the response guy
     """
 
-    r = requests.delete(f'{URL}/user/delete', params={'user_id': id})
-    print(r.status_code)
+    print(client.delete_user(id))
+
+def add_users(users):
+    """
+    This adds a bunch of guys in one go
+    It print the respoing from server
+    """
+
+    print(json.dumps(client.add_users(users)))
+
+def delete_users(ids):
+    """
+    This make a bunch of men go away :(
+    It print the response guys
+    """
+
+    print(client.delete_users(ids))
+
 
-delete_user('6ffcc958-7ee2-4c6c-a273-7d71eecc5b7a')
+if __name__ == '__main__':
+    delete_user('6ffcc958-7ee2-4c6c-a273-7d71eecc5b7a')
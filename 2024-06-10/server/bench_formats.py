@@ -0,0 +1,56 @@
+"""
+Compares the users file formats from formats.py on a generated blob:
+bytes on disk, and how long it takes to write and to load.
+
+    python bench_formats.py [number of users]
+"""
+
+import sys
+import time
+import uuid
+
+import formats
+
+
+def make_users(count: int) -> dict:
+    users = {}
+    for i in range(count):
+        user_id = str(uuid.uuid4())
+        users[user_id] = {
+            "id": user_id,
+            "name": f"User {i}",
+            "email": f"user{i}@example.com",
+            "phone": f"555-{i:07d}",
+            "address": None if i % 3 else f"{i} Main St",
+        }
+    return users
+
+
+def best_of(runs: int, func, *args) -> float:
+    """
+    Returns the quickest of several timed calls, in milliseconds.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main(count: int) -> None:
+    users = make_users(count)
+    print(f"{count} users")
+    print(f"{'format':<12} {'bytes':>12} {'dump ms':>10} {'load ms':>10}")
+    for name, format in formats.FORMATS.items():
+        data = format.dumps(users)
+        assert format.loads(data) == users
+        print(
+            f"{name:<12} {len(data):>12} "
+            f"{best_of(3, format.dumps, users):>10.1f} "
+            f"{best_of(3, format.loads, data):>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,176 @@
+"""
+On-disk formats for the users blob (users.txt, or the journal's snapshot).
+
+Each format turns the whole {user_id: user} blob into bytes and back.
+The binary formats start with a magic header, so we can always tell what
+a file was written with, and migrate it when the configured format changes.
+Anything without a header is JSON, and orjson writes the same bytes on
+disk as compact json does.
+"""
+
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonFormat:
+    """
+    The standard library's json. indent=4 is the original users.txt layout;
+    indent=None writes it compactly, which is smaller and quicker to parse.
+    """
+
+    def __init__(self, name: str, indent: int | None = None):
+        self.name = self.on_disk = name
+        self.indent = indent
+        self.separators = None if indent else (",", ":")
+
+    def dumps(self, users: dict) -> bytes:
+        return json.dumps(
+            users, indent=self.indent, separators=self.separators
+        ).encode()
+
+    def loads(self, data: bytes) -> dict:
+        return json.loads(data)
+
+
+class OrjsonFormat:
+    """
+    Compact JSON through orjson, which is several times quicker both ways.
+    The files are plain JSON, so the json formats can still read them.
+    """
+
+    name = "orjson"
+    on_disk = "json"
+
+    def dumps(self, users: dict) -> bytes:
+        return orjson.dumps(users)
+
+    def loads(self, data: bytes) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackFormat:
+    """
+    The blob as one msgpack map, behind a magic header.
+    """
+
+    name = on_disk = "msgpack"
+    magic = b"\x00USERS-MSGPACK-1\n"
+
+    def dumps(self, users: dict) -> bytes:
+        return self.magic + msgpack.packb(users)
+
+    def loads(self, data: bytes) -> dict:
+        return msgpack.unpackb(memoryview(data)[len(self.magic) :])
+
+
+class StructFormat:
+    """
+    A standard library binary format: after the magic header and a user
+    count, each user is its five fields in FIELDS order, each one a
+    little-endian u32 length followed by that many UTF-8 bytes.
+    A length of NULL_LENGTH stands for None.
+    Values are stored as strings, and fields outside FIELDS are dropped.
+    """
+
+    name = on_disk = "struct"
+    magic = b"\x00USERS-STRUCT-1\n"
+    FIELDS = ("id", "name", "email", "phone", "address")
+    NULL_LENGTH = 0xFFFFFFFF
+
+    def dumps(self, users: dict) -> bytes:
+        pack = struct.Struct("<I").pack
+        null = pack(self.NULL_LENGTH)
+        parts = [self.magic, pack(len(users))]
+        for user in users.values():
+            for field in self.FIELDS:
+                value = user.get(field)
+                if value is None:
+                    parts.append(null)
+                else:
+                    encoded = str(value).encode()
+                    parts.append(pack(len(encoded)))
+                    parts.append(encoded)
+        return b"".join(parts)
+
+    def loads(self, data: bytes) -> dict:
+        unpack_from = struct.Struct("<I").unpack_from
+        view = memoryview(data)
+        offset = len(self.magic)
+        (count,) = unpack_from(view, offset)
+        offset += 4
+        users = {}
+        for _ in range(count):
+            user = {}
+            for field in self.FIELDS:
+                (length,) = unpack_from(view, offset)
+                offset += 4
+                if length == self.NULL_LENGTH:
+                    user[field] = None
+                else:
+                    user[field] = str(view[offset : offset + length], "utf-8")
+                    offset += length
+            users[user["id"]] = user
+        return users
+
+
+FORMATS = {
+    "json-pretty": JsonFormat("json-pretty", indent=4),
+    "json": JsonFormat("json"),
+    "struct": StructFormat(),
+}
+if orjson is not None:
+    FORMATS["orjson"] = OrjsonFormat()
+if msgpack is not None:
+    FORMATS["msgpack"] = MsgpackFormat()
+
+# What we read headerless files with: orjson if we have it, since it parses
+# anything json does.
+_JSON_READER = FORMATS.get("orjson", FORMATS["json"])
+
+
+def get_format(name: str):
+    """
+    Returns the format with the given name, or raises ValueError if it's
+    unknown or its library isn't installed.
+    """
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown or unavailable format {name!r}, expected one of "
+            f"{', '.join(FORMATS)} (orjson and msgpack need to be pip installed)"
+        ) from None
+
+
+def detect(data: bytes) -> str:
+    """
+    Returns the on_disk name of the format data was written in.
+    """
+    if data.startswith(MsgpackFormat.magic):
+        return "msgpack"
+    if data.startswith(StructFormat.magic):
+        return "struct"
+    if data.startswith(b"{\n"):
+        return "json-pretty"
+    return "json"
+
+
+def read(data: bytes) -> tuple[dict, str]:
+    """
+    Parses a users file in whatever format it was written in.
+    Returns the blob and the on_disk name of that format.
+    """
+    on_disk = detect(data)
+    if on_disk.startswith("json"):
+        return _JSON_READER.loads(data), on_disk
+    return get_format(on_disk).loads(data), on_disk
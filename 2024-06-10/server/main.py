@@ -5,17 +5,80 @@ to the various endpoints on this API.
 - SAM 2024-06-10
 """
 
+import asyncio
+import base64
+import hashlib
+import itertools
 import json
 import os
 import inspect
 import uuid
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
 
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-app = FastAPI()
+from metrics import instrument
+from storage import StoreWriter, open_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Runs the store's writer for as long as the app is up, and flushes it
+    and closes the store on the way down.
+    """
+    writer.start()
+    try:
+        yield
+    finally:
+        await writer.stop()
+        store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
 router = APIRouter(prefix="/api")
 
 USERS = "users.txt"
+# Page size for GET /api/users/get when a cursor is given without a limit.
+PAGE_SIZE = 100
+
+
+# The storage backend is pluggable: "file" rewrites users.txt on every
+# mutation, "journal" appends to users.txt.journal and compacts it later.
+# USERS_FORMAT picks how users.txt is serialized (see formats.py); an
+# existing file in another format is migrated the first time it's read.
+store = open_store(
+    USERS,
+    os.environ.get("USERS_BACKEND", "file"),
+    os.environ.get("USERS_FORMAT", "json-pretty"),
+)
+# Handlers are async: reads come from the store's in-memory copy in a worker
+# thread (so re-reading a file another worker changed, or encoding every
+# user, doesn't stall the event loop), and every write goes through this one
+# writer task, which batches whatever is queued into a single store write
+# off the event loop.
+writer = StoreWriter(store)
+
+
+def etag_of(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def conditional_response(
+    request: Request, body: bytes, etag: str, headers: dict | None = None
+) -> Response:
+    """
+    Sends body as JSON with its ETag, or a 304 with no body if the client
+    sent that ETag back in If-None-Match (i.e. it already has this body).
+    """
+    headers = {**(headers or {}), "ETag": etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 def read_users() -> dict:
@@ -23,23 +86,14 @@ def read_users() -> dict:
     Reads users from the 'database', a file on the local machine.
     It's really just a JSON object blob keyed by user IDs and valued
     by blobs with user data ( e.g. name, email, etc ).
-    If the file doesn't exist, returns an empty dictionary.
-    If we fail to load the JSON, we return an empty dictionary.
-    If we successfully load the blob from the file, we return it.
+    The blob returned is the store's in-memory copy, so don't mutate it;
+    go through the writer instead.
     """
-    if not os.path.isfile(USERS):
-        return {}
-    with open(USERS, "r") as file_handle:
-        try:
-            users = json.load(file_handle)
-        except Exception as exc:
-            print(f"FAILED TO LOAD USERS: {exc}")
-            users = {}
-    return users
+    return store.load()
 
 
 @router.post("/users/add")
-def add_user(
+async def add_user(
     name: str,
     email: str | None = None,
     phone: str | None = None,
@@ -49,40 +103,35 @@ def add_user(
     Attempts to add a user to the 'database' given the provided input
     arguments. Returns 200 if the addition was successful.
     """
-    users = read_users()
-    with open(USERS, "w") as file_handle:
-        user_id = str(uuid.uuid4())
-        users[user_id] = {
-            "id": user_id,
-            "name": name,
-            "email": email,
-            "phone": phone,
-            "address": address,
-        }
-        json.dump(users, file_handle, indent=4)
+    user_id = str(uuid.uuid4())
+    user = {
+        "id": user_id,
+        "name": name,
+        "email": email,
+        "phone": phone,
+        "address": address,
+    }
+    await writer.submit([{"op": "add", "user": user}])
     return 200
 
 
 @router.delete("/user/delete")
-def delete_user(user_id: str) -> int:
+async def delete_user(user_id: str) -> int:
     """
     Attempts to delete a user with the given ID from the 'database'.
     Returns 404 if no such user is found.
     Returns 200 if the deletion was successful.
     """
-    users = read_users()
+    users = await asyncio.to_thread(read_users)
     user = users.get(user_id)
     if not user:
         return 404
-    del users[user_id]
-
-    with open(USERS, "w") as file_handle:
-        json.dump(users, file_handle, indent=4)
+    await writer.submit([{"op": "delete", "id": user_id}])
     return 200
 
 
 @router.post("/user/update")
-def update_user(
+async def update_user(
     user_id: str,
     user_name: str | None = None,
     user_address: str | None = None,
@@ -96,26 +145,86 @@ def update_user(
     If no user with the provided ID is found, returns a dictionary with a
     description of the error.
     """
-    users = read_users()
+    users = await asyncio.to_thread(read_users)
     user = users.get(user_id)
     if not user:
         return {"error": "No such user"}
 
-    users[user_id] = {
+    new_user = {
         "id": user_id,
         "name": user_name,
         "address": user_address,
         "email": user_email,
         "phone": user_phone,
     }
-
-    with open(USERS, "w") as file_handle:
-        json.dump(users, file_handle, indent=4)
+    await writer.submit([{"op": "update", "user": new_user}])
     return user
 
 
+@router.patch("/user/update")
+async def patch_user(
+    user_id: str,
+    user_name: str | None = None,
+    user_address: str | None = None,
+    user_email: str | None = None,
+    user_phone: str | None = None,
+) -> dict:
+    """
+    Given input arguments, updates only the non-null fields of the user with
+    the given input ID, leaving the rest as they are, and returns the
+    updated user. The read and the write happen together in the store's
+    writer, so concurrent patches to different fields don't lose each other.
+    If no user with the provided ID is found, returns a dictionary with a
+    description of the error.
+    """
+    fields = {
+        "name": user_name,
+        "address": user_address,
+        "email": user_email,
+        "phone": user_phone,
+    }
+    fields = {field: value for field, value in fields.items() if value is not None}
+    op = {"op": "patch", "id": user_id, "fields": fields}
+    await writer.submit([op])
+    if op["result"] is None:
+        return {"error": "No such user"}
+    return op["result"]
+
+
+@router.put("/users/upsert")
+async def upsert_user(
+    name: str,
+    user_id: str | None = None,
+    email: str | None = None,
+    phone: str | None = None,
+    address: str | None = None,
+    update_existing: bool = True,
+) -> dict:
+    """
+    Creates or updates a user in one atomic step. The existing user is the
+    one with the given ID, or if no ID is given, the first one with the
+    given name.
+    If there is one, its non-null fields are updated (unless
+    update_existing is false, in which case it's left alone).
+    If there isn't, a user is created (with the given ID, if any).
+    Returns whether a user was created, and the user as it now is.
+    """
+    fields = {"name": name, "email": email, "phone": phone, "address": address}
+    fields = {field: value for field, value in fields.items() if value is not None}
+    op = {
+        "op": "upsert",
+        "match": {"id": user_id} if user_id else {"name": name},
+        "fields": fields,
+        "new_id": user_id or str(uuid.uuid4()),
+        "update_existing": update_existing,
+    }
+    await writer.submit([op])
+    return {"created": op["created"], "user": op["result"]}
+
+
 @router.get("/user/get")
-def get_user(
+async def get_user(
+    request: Request,
     user_name: str | None = None,
     user_id: str | None = None,
     user_address: str | None = None,
@@ -126,6 +235,8 @@ def get_user(
     Given input arguments, attempt to retrieve a user that matches
     all non-null arguments. If no such user is found, returns a
     dictionary with a description of the error.
+    A found user comes with an ETag, so clients can revalidate a cached
+    copy with If-None-Match and get a 304 if it hasn't changed.
     """
     args_map = {
         "name": user_name,
@@ -139,59 +250,184 @@ def get_user(
         return {
             "error": f"You must provide at least one of {', '.join(args_map.keys())}"
         }
-    data = read_users().values()
     # Filter the arguments to the function to only include the ones that aren't null.
     non_null_args = {
         arg_name: arg for arg_name, arg in args_map.items() if arg is not None
     }
-    # For every user,
-    for entry in data:
-        # if every input argument matches the corresponding value on the user,
-        if all(
-            [
-                entry[arg_name] == arg_value
-                for arg_name, arg_value in non_null_args.items()
-            ]
-        ):
-            # then we've found the user we're looking for, because all of our query
-            # terms matched this user.
-            return entry
+    # The store keeps a hash index per field, so rather than scanning every
+    # user we look up each query term and intersect the matching IDs.
+    entry = await asyncio.to_thread(store.find, non_null_args)
+    if entry is not None:
+        body = json.dumps(entry).encode()
+        return conditional_response(request, body, etag_of(body))
 
     # If we reach here, it means that no user matched all of our input query terms.
     return {"error": f"No such user given args: {non_null_args}"}
 
 
+def encode_cursor(user_id: str) -> str:
+    """
+    Turns the last user ID of a page into an opaque cursor for the next one.
+    """
+    return base64.urlsafe_b64encode(user_id.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        # urlsafe_b64decode() quietly drops characters outside the alphabet,
+        # so "!!!" would decode to "" and restart from the first page.
+        return base64.b64decode(cursor, altchars=b"-_", validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.") from None
+
+
+def ndjson(users: Iterator[dict]) -> Iterator[bytes]:
+    for user in users:
+        yield (json.dumps(user) + "\n").encode()
+
+
 @router.get("/users/get")
-def list_users(limit: int = 0) -> list[dict]:
+async def list_users(
+    request: Request,
+    limit: int = Query(0, ge=0),
+    cursor: str | None = None,
+    stream: bool = False,
+) -> list[dict]:
     """
     List all of the users from the 'database'.
+    With a limit (or a cursor), users come back a page at a time in ID
+    order. If there may be more, the X-Next-Cursor response header holds
+    the cursor to pass in for the next page.
+    With stream=true, users are sent as newline delimited JSON straight
+    from a generator, so nothing is materialized up front.
+    Otherwise the response has an ETag, and If-None-Match gets a 304 if
+    the users are unchanged.
     """
-    data = read_users()
-    if not data:
-        return []
-    if limit:
-        return list(data.values())[:limit]
-    return list(data.values())
+    after = decode_cursor(cursor) if cursor else None
+    if stream:
+        users = store.iter_users(after)
+        if limit:
+            users = itertools.islice(users, limit)
+        return StreamingResponse(ndjson(users), media_type="application/x-ndjson")
+    headers = {}
+    if not limit and after is None:
+        users = await asyncio.to_thread(lambda: list(read_users().values()))
+    else:
+        users = await asyncio.to_thread(store.page, after, limit or PAGE_SIZE)
+        if len(users) == (limit or PAGE_SIZE):
+            headers["X-Next-Cursor"] = encode_cursor(users[-1]["id"])
+    body = await asyncio.to_thread(lambda: json.dumps(users).encode())
+    return conditional_response(request, body, etag_of(body), headers)
 
 
-@router.get("/docs")
-def get_documentation() -> list[dict]:
+def parse_bulk_body(body: bytes, content_type: str) -> list:
     """
-    Get docs. The most important endpoint!
+    Parses a bulk request body: either one JSON array of users, or
+    newline delimited JSON with one user per line.
+    """
+    try:
+        if "ndjson" in content_type or not body.lstrip().startswith(b"["):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        return json.loads(body)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid body: {exc}") from None
+
+
+def bulk_add_ops(body: bytes, content_type: str) -> list[dict]:
+    """
+    Parses a bulk request body and turns each user blob in it into an add
+    operation. Raises a 400 if any of them isn't a valid user.
+    """
+    ops = []
+    for position, entry in enumerate(parse_bulk_body(body, content_type)):
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise HTTPException(
+                status_code=400, detail=f"User {position} must have a name."
+            )
+        for field in ("id", "name", "email", "phone", "address"):
+            if not isinstance(entry.get(field), (str, type(None))):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"User {position}'s {field} must be a string.",
+                )
+        ops.append(
+            {
+                "op": "add",
+                "user": {
+                    "id": entry.get("id") or str(uuid.uuid4()),
+                    "name": entry["name"],
+                    "email": entry.get("email"),
+                    "phone": entry.get("phone"),
+                    "address": entry.get("address"),
+                },
+            }
+        )
+    return ops
+
+
+@router.post("/users/bulk")
+async def bulk_add_users(request: Request) -> dict:
+    """
+    Adds many users in a single write. The body is a JSON array of user
+    blobs, or NDJSON (e.g. the output of /users/export).
+    Each blob must have a name, and may have email, phone, address and id;
+    users with an existing id are overwritten, users without one get a new id.
+    Returns the number of users added and their ids, in input order.
+    """
+    # Parsing and checking a big body takes a while, so it's done off the
+    # event loop.
+    ops = await asyncio.to_thread(
+        bulk_add_ops, await request.body(), request.headers.get("content-type", "")
+    )
+    # One submit is one write to the store, however many users there are.
+    await writer.submit(ops)
+    return {"added": len(ops), "ids": [op["user"]["id"] for op in ops]}
+
+
+@router.get("/users/export")
+async def export_users() -> StreamingResponse:
+    """
+    Streams every user as newline delimited JSON, in ID order.
     """
+    return StreamingResponse(
+        ndjson(store.iter_users()), media_type="application/x-ndjson"
+    )
 
+
+def build_documentation() -> list[dict]:
+    """
+    Walks the router's routes and describes each endpoint's path, methods,
+    response type and parameters. The Request some endpoints take is
+    FastAPI's to fill in, not the client's, so it isn't listed.
+    """
     return [
         {
             "path": route.path,
-            "methods": route.methods,
+            "methods": sorted(route.methods),
             "response_type": str(route.response_model),
             "parameters": [
                 {"name": parameter.name, "parameter_type": str(parameter.annotation)}
                 for parameter in inspect.signature(route.endpoint).parameters.values()
+                if parameter.annotation is not Request
             ],
         }
         for route in router.routes
     ]
 
 
+@router.get("/docs")
+async def get_documentation(request: Request) -> list[dict]:
+    """
+    Get docs. The most important endpoint!
+    The routes can't change once the router is included, so the docs are
+    built and encoded once (see the bottom of this file). Clients that send
+    back the ETag they got get a 304 with no body.
+    """
+    return conditional_response(request, DOCS_BODY, DOCS_ETAG)
+
+
 app.include_router(router=router)
+
+# Every route is registered by now, so build the docs payload once.
+DOCS_BODY = json.dumps(build_documentation()).encode()
+DOCS_ETAG = etag_of(DOCS_BODY)
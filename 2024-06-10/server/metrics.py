@@ -0,0 +1,68 @@
+"""
+Prometheus metrics for the user server: per-route request counts, latency
+histograms and in-flight gauges, plus timings from the storage layer.
+Scrape them from GET /metrics.
+"""
+
+import time
+
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+from prometheus_client import generate_latest
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled.", ["method", "route", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ["method", "route"]
+)
+# The route is only known once the router has matched the request, so the
+# in-flight gauge can only be split by method.
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled.", ["method"]
+)
+
+STORE_LOAD_SECONDS = Histogram(
+    "users_store_load_seconds", "Time spent reading and parsing the users file."
+)
+STORE_WRITE_SECONDS = Histogram(
+    "users_store_write_seconds", "Time spent persisting a batch of writes.", ["backend"]
+)
+STORE_BYTES_WRITTEN = Counter(
+    "users_store_bytes_written_total", "Bytes written by the store.", ["file"]
+)
+
+
+def route_of(request: Request) -> str:
+    """
+    Returns the path template of the route a handled request matched (e.g.
+    '/api/user/get'), so raw URLs don't blow up the label cardinality.
+    The router records the route on the request scope while dispatching.
+    """
+    return getattr(request.scope.get("route"), "path", "<unmatched>")
+
+
+def instrument(app: FastAPI) -> None:
+    """
+    Adds the request metrics middleware and the /metrics endpoint to app.
+    """
+
+    @app.middleware("http")
+    async def record_request(request: Request, call_next):
+        in_progress = IN_PROGRESS.labels(request.method)
+        in_progress.inc()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            method, route = request.method, route_of(request)
+            REQUEST_SECONDS.labels(method, route).observe(time.perf_counter() - start)
+            REQUESTS.labels(method, route, str(status)).inc()
+            in_progress.dec()
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics() -> Response:
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,909 @@
+"""
+Storage backends for the users 'database'.
+
+Every backend keeps the whole users blob in memory, keyed by user ID, and
+applies mutations as a list of operations:
+
+    {"op": "add", "user": {...}}
+    {"op": "update", "user": {...}}
+    {"op": "delete", "id": "..."}
+
+How those operations reach the disk is what differs between backends.
+There are also two conditional operations, which are resolved into one of
+the above under the write lock, so their read-then-write is atomic:
+
+    {"op": "patch", "id": "...", "fields": {...}}
+    {"op": "upsert", "match": {...}, "fields": {...}, "new_id": "...",
+     "update_existing": bool}
+
+Once applied, those carry their outcome in "result" (the user, or None)
+and, for upsert, "created".
+"""
+
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+
+import formats
+from metrics import STORE_BYTES_WRITTEN, STORE_LOAD_SECONDS, STORE_WRITE_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def stat_signature(path: str | int) -> tuple[int, int] | None:
+    """
+    Returns a cheap (mtime, size) signature of a file, or None if it's missing.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_temp(path: str, data: bytes) -> str:
+    """
+    Writes data to a temp file next to path and fsyncs it, ready to be
+    renamed over path. Returns the temp file's path.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file_handle:
+            file_handle.write(data)
+            STORE_BYTES_WRITTEN.labels("snapshot").inc(len(data))
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Writes data to a temp file next to path, fsyncs it, then renames it
+    over path, so anyone reading path sees the old or the new contents but
+    never half of either.
+    """
+    tmp_path = write_temp(path, data)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def inode(path: str) -> int | None:
+    """
+    Returns the inode number of path, or None if it's missing.
+    """
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def apply_op(users: dict, op: dict) -> None:
+    """
+    Applies a single operation to an in-memory users blob.
+    Replaying the same operation twice leaves the blob unchanged, which is
+    what lets the journal be replayed safely after a crash.
+    """
+    if op["op"] in ("add", "update"):
+        users[op["user"]["id"]] = op["user"]
+    elif op["op"] == "delete":
+        users.pop(op["id"], None)
+    else:
+        raise ValueError(f"Unknown operation: {op['op']}")
+
+
+def resolve_op(users: dict, index: "UserIndex", op: dict) -> dict | None:
+    """
+    Turns a conditional operation into the plain one it amounts to given the
+    current users, recording its outcome on op. Plain operations are
+    returned as is. Returns None if there's nothing to write.
+    """
+    if op["op"] == "patch":
+        user = users.get(op["id"])
+        if user is None:
+            op["result"] = None
+            return None
+        op["result"] = {**user, **op["fields"]}
+        return {"op": "update", "user": op["result"]}
+    if op["op"] == "upsert":
+        user = index.find(users, op["match"])
+        op["created"] = user is None
+        if user is None:
+            op["result"] = {
+                "id": op["new_id"],
+                "name": None,
+                "email": None,
+                "phone": None,
+                "address": None,
+                **op["fields"],
+            }
+            return {"op": "add", "user": op["result"]}
+        if not op["update_existing"] or not op["fields"]:
+            op["result"] = user
+            return None
+        op["result"] = {**user, **op["fields"]}
+        return {"op": "update", "user": op["result"]}
+    return op
+
+
+class UserIndex:
+    """
+    Hash indexes from field value to user IDs, one per queryable field.
+    Each bucket is a dict used as an insertion-ordered set, so lookups
+    return the same user a linear scan would have found first.
+    We also keep every ID in a sorted list, which is what keyset
+    pagination walks. add() and remove() only touch the buckets; a batch's
+    new and deleted IDs go through merge_ids() once at the end, since
+    inserting them one at a time would cost O(N) each.
+    """
+
+    FIELDS = ("name", "email", "phone", "address")
+
+    def __init__(self):
+        self.buckets: dict[str, dict[str, dict[str, None]]] = {
+            field: {} for field in self.FIELDS
+        }
+        self.ids: list[str] = []
+        # For a copy(), the (field, value) buckets it has copied from the
+        # original so far; None means every bucket is its own.
+        self._copied: set[tuple[str, str]] | None = None
+
+    def copy(self) -> "UserIndex":
+        """
+        Returns an index that can be changed without changing this one.
+        The per-field dicts are copied up front, but each bucket is only
+        copied the first time the copy changes it.
+        """
+        index = UserIndex()
+        index.buckets = {field: dict(self.buckets[field]) for field in self.FIELDS}
+        index.ids = self.ids
+        index._copied = set()
+        return index
+
+    def _bucket(self, field: str, value: str) -> dict[str, None]:
+        """
+        Returns the bucket for a value, creating it if need be, that's safe
+        to change (i.e. not shared with the index this one was copied from).
+        """
+        buckets = self.buckets[field]
+        bucket = buckets.get(value)
+        if bucket is None:
+            bucket = buckets[value] = {}
+        elif self._copied is not None and (field, value) not in self._copied:
+            bucket = buckets[value] = dict(bucket)
+        else:
+            return bucket
+        if self._copied is not None:
+            self._copied.add((field, value))
+        return bucket
+
+    def rebuild(self, users: dict) -> None:
+        self.buckets = {field: {} for field in self.FIELDS}
+        self.ids = sorted(users)
+        for user in users.values():
+            self._add_fields(user)
+
+    def add(self, user: dict) -> None:
+        self._add_fields(user)
+
+    def _add_fields(self, user: dict) -> None:
+        for field in self.FIELDS:
+            value = user.get(field)
+            if value is not None:
+                self._bucket(field, value)[user["id"]] = None
+
+    def merge_ids(self, added: list[str], removed: set[str]) -> None:
+        """
+        Adds and removes IDs from the sorted list in one pass. The new IDs
+        are sorted and appended as a second run, which sort() merges in
+        linear time.
+        """
+        if not added and not removed:
+            return
+        ids = [user_id for user_id in self.ids if user_id not in removed]
+        ids.extend(sorted(added))
+        ids.sort()
+        self.ids = ids
+
+    def remove(self, user: dict) -> None:
+        for field in self.FIELDS:
+            value = user.get(field)
+            if value not in self.buckets[field]:
+                continue
+            bucket = self._bucket(field, value)
+            bucket.pop(user["id"], None)
+            if not bucket:
+                del self.buckets[field][value]
+
+    def find(self, users: dict, query: dict) -> dict | None:
+        """
+        Returns the first user matching every field in query, or None.
+        Candidate sets are intersected smallest first.
+        """
+        if "id" in query:
+            user = users.get(query["id"])
+            if user is None:
+                return None
+            if all(user.get(field) == value for field, value in query.items()):
+                return user
+            return None
+        candidates = []
+        for field, value in query.items():
+            bucket = self.buckets[field].get(value)
+            if not bucket:
+                return None
+            candidates.append(bucket)
+        candidates.sort(key=len)
+        smallest, rest = candidates[0], candidates[1:]
+        for user_id in smallest:
+            if all(user_id in bucket for bucket in rest):
+                return users[user_id]
+        return None
+
+
+class FileLock:
+    """
+    A cross-process lock: fcntl.flock on a '.lock' file next to the store.
+    Several uvicorn workers share one store, so every write takes this
+    lock around its read-modify-write.
+    It also excludes other threads in this process, and nested
+    acquisitions from the same thread are counted rather than re-flocked,
+    since flock() on a held fd would just convert the lock.
+    On platforms without fcntl it's only the thread lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: int | None = None
+        self._depth = 0
+        self._owner: int | None = None
+        # A plain Lock rather than an RLock, so a lock taken in one thread
+        # can be handed off to and released by another (see compact()).
+        self._thread_lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._owner == threading.get_ident():
+            self._depth += 1
+            return True
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if fcntl is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(self._fd, flags)
+            except BlockingIOError:
+                self._thread_lock.release()
+                return False
+        self._owner = threading.get_ident()
+        self._depth = 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._owner = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class UserStore:
+    """
+    Base class for the storage backends. Subclasses implement load(),
+    _persist() and migrate(), everything else is shared.
+    There are three locks, always taken in this order:
+    - write_lock serializes writers in this process, and is held for the
+      whole write, disk I/O included.
+    - file_lock serializes writers across processes.
+    - lock guards which blob and index are current. Writers apply a batch
+      to copies and only take it to swap them in once they're on disk, so
+      readers are never stuck behind a batch or an fsync.
+    """
+
+    def __init__(self, path: str, format: str = "json-pretty"):
+        self.path = path
+        self.format = formats.get_format(format)
+        self.write_lock = threading.RLock()
+        self.file_lock = FileLock(f"{path}.lock")
+        self.lock = threading.RLock()
+        self.index = UserIndex()
+        self._indexed: dict | None = None
+        # Set while our own write is on its way to disk. The files are
+        # changing under us then, but the in-memory blob is already ahead
+        # of them, so load() shouldn't go re-reading them.
+        self._writing = False
+        self._pending: list[dict] = []
+        self._pending_lock = threading.Lock()
+
+    def _synced_index(self, users: dict) -> UserIndex:
+        """
+        Returns the index, rebuilding it if load() handed us a different
+        blob than the one it was built from (e.g. the file changed on disk).
+        """
+        if users is not self._indexed:
+            # A new index rather than rebuilding this one, since readers may
+            # still be using it outside the lock.
+            index = UserIndex()
+            index.rebuild(users)
+            self.index, self._indexed = index, users
+        return self.index
+
+    def load(self, strict: bool = False) -> dict:
+        """
+        Returns the current blob. Reads fall back to an empty one if the
+        users file fails to load; with strict, which the write path uses,
+        that raises instead, so we never write an empty blob over it.
+        """
+        raise NotImplementedError
+
+    def migrate(self) -> None:
+        """
+        Rewrites the users file in the configured format if it's in another
+        one. open_store() calls this once, which is how switching formats
+        migrates existing data.
+        """
+        raise NotImplementedError
+
+    def _read_snapshot(
+        self, strict: bool = False
+    ) -> tuple[dict, tuple[int, int] | None, str | None]:
+        """
+        Reads the users file in whatever format it's in, returning the blob,
+        the stat signature of what we read, and the format it was in.
+        If the file doesn't exist or is empty, the blob is empty. If it fails
+        to load, so is the blob, unless strict is set, in which case we raise.
+        """
+        try:
+            file_handle = open(self.path, "rb")
+        except FileNotFoundError:
+            return {}, None, None
+        start = time.perf_counter()
+        with file_handle:
+            # Stat the handle we actually read, in case the file was
+            # replaced between an earlier stat and the open.
+            stat = stat_signature(file_handle.fileno())
+            data = file_handle.read()
+        if not data.strip():
+            return {}, stat, None
+        try:
+            users, on_disk = formats.read(data)
+        except Exception as exc:
+            if strict:
+                raise ValueError(f"Failed to load {self.path}: {exc}") from exc
+            print(f"FAILED TO LOAD USERS: {exc}")
+            return {}, stat, None
+        STORE_LOAD_SECONDS.observe(time.perf_counter() - start)
+        return users, stat, on_disk
+
+    def _persist(self, users: dict, ops: list[dict]) -> None:
+        raise NotImplementedError
+
+    def _install(self, users: dict) -> None:
+        """
+        Makes users, which was just persisted, the blob load() returns.
+        Called with self.lock held.
+        """
+        raise NotImplementedError
+
+    def _after_commit(self) -> None:
+        """
+        Runs after a batch is installed, still under the write locks.
+        """
+
+    def apply(self, ops: list[dict]) -> None:
+        """
+        Applies the operations to the in-memory blob and persists them.
+        Writes are group committed: callers queue their ops, and whichever
+        thread gets the lock next flushes everything queued so far in one
+        go, so N concurrent writers cost one flush instead of N.
+        """
+        request = {"ops": ops, "done": False, "error": None}
+        with self._pending_lock:
+            self._pending.append(request)
+        with self.write_lock:
+            if not request["done"]:
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                try:
+                    self._commit([op for queued in batch for op in queued["ops"]])
+                except Exception as exc:
+                    for queued in batch:
+                        queued["error"] = exc
+                for queued in batch:
+                    queued["done"] = True
+        if request["error"] is not None:
+            raise request["error"]
+
+    def _commit(self, ops: list[dict]) -> None:
+        with self.write_lock, self.file_lock:
+            with self.lock:
+                # Re-load under the file lock, so we apply our ops on top of
+                # whatever other processes wrote rather than clobbering it.
+                users = self.load(strict=True)
+                index = self._synced_index(users)
+            # The batch is applied to copies, which only replace the blob and
+            # index once they're on disk. Readers never see a half-applied
+            # batch, and if applying or persisting it fails, nothing changed.
+            users, index = dict(users), index.copy()
+            resolved = []
+            # Whether each ID we touch existed before this batch.
+            existed: dict[str, bool] = {}
+            for op in ops:
+                op = resolve_op(users, index, op)
+                if op is None:
+                    continue
+                resolved.append(op)
+                user_id = op["id"] if op["op"] == "delete" else op["user"]["id"]
+                existed.setdefault(user_id, user_id in users)
+                if user_id in users:
+                    index.remove(users[user_id])
+                apply_op(users, op)
+                if op["op"] != "delete":
+                    index.add(op["user"])
+            if not resolved:
+                return
+            index.merge_ids(
+                [i for i, was in existed.items() if not was and i in users],
+                {i for i, was in existed.items() if was and i not in users},
+            )
+            with self.lock:
+                self._writing = True
+            start = time.perf_counter()
+            try:
+                self._persist(users, resolved)
+            except BaseException:
+                with self.lock:
+                    self._writing = False
+                raise
+            finally:
+                STORE_WRITE_SECONDS.labels(self.name).observe(
+                    time.perf_counter() - start
+                )
+            with self.lock:
+                self._writing = False
+                self._install(users)
+                self.index, self._indexed = index, users
+            self._after_commit()
+
+    def snapshot(self) -> tuple[dict, UserIndex]:
+        """
+        Returns the current blob and its index. Writers replace them rather
+        than changing them, so they can be read without holding the lock,
+        and stay consistent with each other while a write goes on.
+        """
+        with self.lock:
+            users = self.load()
+            return users, self._synced_index(users)
+
+    def find(self, query: dict) -> dict | None:
+        """
+        Returns the first user matching every field in query, or None.
+        """
+        users, index = self.snapshot()
+        return index.find(users, query)
+
+    def page(self, after: str | None, limit: int) -> list[dict]:
+        """
+        Returns up to limit users, in ID order, whose ID sorts after the
+        given one (or from the start if after is None).
+        """
+        users, index = self.snapshot()
+        start = 0 if after is None else bisect.bisect_right(index.ids, after)
+        return [users[user_id] for user_id in index.ids[start : start + limit]]
+
+    def iter_users(self, after: str | None = None, chunk: int = 500) -> Iterator[dict]:
+        """
+        Yields every user after the given ID, in ID order, a page at a time.
+        Each page comes from the snapshot current at the time, so a slow
+        consumer doesn't hold anything up, and memory use doesn't grow with
+        the store.
+        """
+        while True:
+            page = self.page(after, chunk)
+            yield from page
+            if len(page) < chunk:
+                return
+            after = page[-1]["id"]
+
+    def add(self, user: dict) -> None:
+        self.apply([{"op": "add", "user": user}])
+
+    def update(self, user: dict) -> None:
+        self.apply([{"op": "update", "user": user}])
+
+    def delete(self, user_id: str) -> None:
+        self.apply([{"op": "delete", "id": user_id}])
+
+    def close(self) -> None:
+        self.file_lock.close()
+
+
+class FileStore(UserStore):
+    """
+    The original backend: a single pretty-printed JSON blob that gets
+    rewritten in full on every mutation.
+    The parsed blob is cached, keyed on the file's (mtime, size), so edits
+    made by another process are picked up and we otherwise never re-parse.
+    Writes go to a temp file that's renamed over the original, so readers
+    never see a half-written file and don't need the lock.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str, format: str = "json-pretty"):
+        super().__init__(path, format)
+        self._cache: dict = {}
+        self._cache_stat: tuple[int, int] | None = None
+
+    def load(self, strict: bool = False) -> dict:
+        """
+        If the file doesn't exist, returns an empty dictionary.
+        If we fail to load the JSON, we return an empty dictionary, or raise
+        if strict is set.
+        If we successfully load the blob from the file, we return it.
+        """
+        with self.lock:
+            if self._writing:
+                return self._cache
+            stat = stat_signature(self.path)
+            if stat is None:
+                self._cache, self._cache_stat = {}, None
+                return self._cache
+            if stat == self._cache_stat:
+                return self._cache
+            users, stat, _ = self._read_snapshot(strict)
+            if not users:
+                # Don't cache a failed load, the file may have been bad.
+                return users
+            self._cache, self._cache_stat = users, stat
+            return users
+
+    def _persist(self, users: dict, ops: list[dict]) -> None:
+        write_atomic(self.path, self.format.dumps(users))
+
+    def _install(self, users: dict) -> None:
+        self._cache, self._cache_stat = users, stat_signature(self.path)
+
+    def migrate(self) -> None:
+        with self.file_lock, self.lock:
+            users, stat, on_disk = self._read_snapshot()
+            if on_disk is None or on_disk == self.format.on_disk:
+                return
+            print(f"MIGRATING {self.path} FROM {on_disk} TO {self.format.name}")
+            write_atomic(self.path, self.format.dumps(users))
+            self._cache, self._cache_stat = users, stat_signature(self.path)
+
+
+class JournalStore(UserStore):
+    """
+    An append-only backend. The users file is kept as a snapshot, and every
+    mutation is appended to '<path>.journal' as one JSON line and fsynced,
+    so a write costs O(1) bytes instead of O(users).
+    On startup we load the snapshot and replay the journal on top of it.
+    Other processes appending to the same journal are picked up by
+    replaying whatever was added past our offset.
+    Once the journal grows past compact_every operations, a background
+    thread folds it into a fresh snapshot.
+    """
+
+    name = "journal"
+
+    def __init__(
+        self, path: str, format: str = "json-pretty", compact_every: int = 1000
+    ):
+        super().__init__(path, format)
+        self.journal_path = f"{path}.journal"
+        self.compacting_path = f"{path}.journal.compacting"
+        self.compact_lock_path = f"{path}.compact.lock"
+        self.compact_every = compact_every
+        self._users: dict | None = None
+        self._journal = None
+        self._journal_ino: int | None = None
+        self._journal_offset = 0
+        self._journal_ops = 0
+        self._snapshot_stat: tuple[int, int] | None = None
+        self._snapshot_format: str | None = None
+        self._compactor: threading.Thread | None = None
+
+    def _replay(self, path: str, users: dict, offset: int = 0) -> tuple[int, int]:
+        """
+        Replays a journal file onto users from the given byte offset.
+        Returns how many ops were applied and the offset just past the last
+        complete line. A torn line (from a crash, or a writer in another
+        process mid-append) is left for later.
+        """
+        if not os.path.isfile(path):
+            return 0, 0
+        count = 0
+        with open(path, "rb") as file_handle:
+            file_handle.seek(offset)
+            for line in file_handle:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    print(f"SKIPPING TORN JOURNAL LINE: {line!r}")
+                    continue
+                apply_op(users, op)
+                count += 1
+        return count, offset
+
+    def _is_current(self) -> bool:
+        """
+        Whether our in-memory copy was built from the snapshot and journal
+        that are on disk now (i.e. nobody compacted behind our back).
+        """
+        if self._users is None:
+            return False
+        try:
+            journal = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return False
+        return (
+            journal.st_ino == self._journal_ino
+            and journal.st_size >= self._journal_offset
+            and stat_signature(self.path) == self._snapshot_stat
+        )
+
+    def load(self, strict: bool = False) -> dict:
+        with self.lock:
+            if self._writing:
+                return self._users
+            if self._is_current():
+                if os.path.getsize(self.journal_path) > self._journal_offset:
+                    # Copy before catching up, so the blob's identity changes
+                    # and the index gets rebuilt.
+                    users = dict(self._users)
+                    count, self._journal_offset = self._replay(
+                        self.journal_path, users, self._journal_offset
+                    )
+                    self._journal_ops += count
+                    self._users = users
+                return self._users
+            while True:
+                journal_ino = inode(self.journal_path)
+                users, snapshot_stat, snapshot_format = self._read_snapshot(strict)
+                # A '.compacting' file is a journal being folded into the
+                # snapshot (or left over from a crash mid-compaction). Its ops
+                # may or may not be in the snapshot already, but replay is
+                # idempotent, so we just apply it again.
+                self._replay(self.compacting_path, users)
+                if self._journal is not None:
+                    self._journal.close()
+                self._journal = open(self.journal_path, "ab")
+                self._journal_ino = os.fstat(self._journal.fileno()).st_ino
+                self._journal_ops, self._journal_offset = self._replay(
+                    self.journal_path, users
+                )
+                # Readers don't hold the file lock, so another process may
+                # have rotated the journal or replaced the snapshot while we
+                # read them, and we'd have missed the ops in between. If
+                # neither changed, what we read is consistent.
+                if (
+                    journal_ino == self._journal_ino == inode(self.journal_path)
+                    and stat_signature(self.path) == snapshot_stat
+                ):
+                    break
+            # Don't count a snapshot we couldn't parse as current, so the
+            # next load reads it again (and a strict one raises).
+            self._snapshot_stat = snapshot_stat if snapshot_format else None
+            self._snapshot_format = snapshot_format
+            self._users = users
+            return users
+
+    def _persist(self, users: dict, ops: list[dict]) -> None:
+        data = "".join(json.dumps(op) + "\n" for op in ops).encode()
+        self._journal.write(data)
+        STORE_BYTES_WRITTEN.labels("journal").inc(len(data))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_offset += len(data)
+        self._journal_ops += len(ops)
+
+    def _install(self, users: dict) -> None:
+        self._users = users
+
+    def _after_commit(self) -> None:
+        # Compaction snapshots the installed blob, so it has to wait until
+        # the batch is installed.
+        if self._journal_ops >= self.compact_every:
+            self.compact()
+
+    def compact(self, wait: bool = False) -> None:
+        """
+        Rotates the journal out and writes a new snapshot in the background.
+        Writers only block for the rotation, not for the snapshot write.
+        The compactor holds '<path>.compact.lock' until it's done, which is
+        how we tell another process's compaction from a crashed one.
+        """
+        with self.file_lock, self.lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            users = self.load(strict=True)
+            compact_lock = FileLock(self.compact_lock_path)
+            if not compact_lock.acquire(blocking=False):
+                compact_lock.close()
+                return
+            self._journal.close()
+            if os.path.isfile(self.compacting_path):
+                # A previous compaction crashed before finishing; fold the
+                # current journal into it and redo it.
+                with open(self.journal_path, "rb") as src:
+                    with open(self.compacting_path, "ab") as dst:
+                        dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.compacting_path)
+            self._journal = open(self.journal_path, "ab")
+            self._journal_ino = os.fstat(self._journal.fileno()).st_ino
+            self._journal_offset = 0
+            self._journal_ops = 0
+            # User blobs are replaced rather than mutated, so a shallow
+            # copy is a consistent snapshot.
+            snapshot = dict(users)
+            self._compactor = threading.Thread(
+                target=self._write_snapshot, args=(snapshot, compact_lock), daemon=True
+            )
+            self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def _write_snapshot(self, snapshot: dict, compact_lock: FileLock) -> None:
+        try:
+            tmp_path = write_temp(self.path, self.format.dumps(snapshot))
+            try:
+                # Writing the snapshot out can take a while, so only swapping
+                # it in is done under the file lock. That way a writer, which
+                # re-loads under the file lock, never sees the new snapshot
+                # with the '.compacting' file it replaces still there, or the
+                # old one with it gone.
+                with self.file_lock:
+                    os.replace(tmp_path, self.path)
+                    os.remove(self.compacting_path)
+                    with self.lock:
+                        self._snapshot_stat = stat_signature(self.path)
+                        self._snapshot_format = self.format.on_disk
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        finally:
+            compact_lock.release()
+            compact_lock.close()
+
+    def migrate(self) -> None:
+        """
+        The snapshot is only ever written by compaction, which holds the
+        compact lock, so a format change is migrated by compacting.
+        """
+        with self.file_lock, self.lock:
+            self.load()
+            on_disk = self._snapshot_format
+            if on_disk is None or on_disk == self.format.on_disk:
+                return
+            print(f"MIGRATING {self.path} FROM {on_disk} TO {self.format.name}")
+            self.compact()
+
+    def close(self) -> None:
+        # Join outside the lock, the compactor takes it when it finishes.
+        if self._compactor is not None:
+            self._compactor.join()
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._users = None
+        super().close()
+
+
+class StoreWriter:
+    """
+    The single writer for a store used from asyncio code. Handlers await
+    submit(ops); one task drains everything queued since its last write,
+    applies it as a single store.apply() in a worker thread, and then
+    resolves every waiter. Writes are coalesced for free under load, and
+    the event loop never blocks on disk I/O.
+    """
+
+    def __init__(self, store: UserStore):
+        self.store = store
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, ops: list[dict]) -> None:
+        """
+        Queues ops for the writer and waits until they're on disk.
+        """
+        if self._task is None:
+            # Nothing would ever take them off the queue.
+            raise RuntimeError("The store writer isn't running, start() it first")
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((ops, done))
+        await done
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # None is stop()'s sentinel; flush what came before it first.
+            stopping = None in batch
+            batch = [queued for queued in batch if queued is not None]
+            if not batch:
+                continue
+            ops = [op for queued_ops, _ in batch for op in queued_ops]
+            try:
+                await asyncio.to_thread(self.store.apply, ops)
+            except Exception as exc:
+                for _, done in batch:
+                    if not done.done():
+                        done.set_exception(exc)
+            else:
+                for _, done in batch:
+                    if not done.done():
+                        done.set_result(None)
+
+    async def stop(self) -> None:
+        """
+        Flushes anything already queued, then stops the writer task.
+        """
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+
+BACKENDS = {backend.name: backend for backend in (FileStore, JournalStore)}
+
+
+def open_store(
+    path: str, backend: str = "file", format: str = "json-pretty"
+) -> UserStore:
+    """
+    Returns the storage backend with the given name ('file' or 'journal'),
+    writing the users file in the given format (see formats.FORMATS).
+    """
+    try:
+        store = BACKENDS[backend](path, format)
+    except KeyError:
+        raise ValueError(
+            f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}"
+        ) from None
+    store.migrate()
+    return store
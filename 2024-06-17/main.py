@@ -1,15 +1,242 @@
 import unittest
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
 import uuid
-from fastapi import FastAPI, APIRouter, HTTPException
+from collections.abc import Iterator
+from contextlib import contextmanager
+from fastapi import FastAPI, APIRouter, Body, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+from prometheus_client import generate_latest
+
+# Our DB: in-memory by default, or a file (e.g. USERS_DB=users.db) that
+# survives restarts
+DATABASE = os.environ.get("USERS_DB", "file::memory:?cache=shared")
+POOL_SIZE = int(os.environ.get("USERS_DB_POOL_SIZE", "8"))
+# The most users GET /get/all will put in one page; streaming isn't capped
+MAX_PAGE = 1000
+
+
+class ConnectionPool:
+    """A fixed set of connections shared by FastAPI's worker threads
+
+    A thread takes a connection for as long as it needs it, so no two
+    requests ever run statements on the same connection at once. Taking one
+    again on the same thread (e.g. upsertUser calling createUser) hands back
+    the one it already holds.
+
+    A file DB is put in WAL mode, so readers don't block the writer or each
+    other. An in-memory DB only lives as long as its connections and its
+    connections would lock each other out, so it gets just the one.
+
+    Connections are in autocommit mode: sqlite3 never opens a transaction
+    behind our backs, so a write either runs inside transaction() or is
+    committed on its own, and can't be left uncommitted holding the lock.
+    """
+
+    def __init__(self, database, size):
+        self.database = database
+        self.in_memory = ":memory:" in database or "mode=memory" in database
+        self.size = 1 if self.in_memory else size
+        self.idle = queue.LifoQueue()
+        self.local = threading.local()
+        for _ in range(self.size):
+            self.idle.put(self.connect())
+
+    def connect(self) -> sqlite3.Connection:
+        """Opens one connection for the pool
+
+        Returns:
+            sqlite3.Connection
+        """
+        connection = sqlite3.connect(
+            self.database,
+            uri=True,
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        if not self.in_memory:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Hands this thread a connection until the with block ends
+
+        Yields:
+            sqlite3.Connection
+        """
+        held = getattr(self.local, "connection", None)
+        if held is not None:
+            yield held
+            return
+        connection = self.idle.get()
+        self.local.connection = connection
+        try:
+            yield connection
+        finally:
+            self.local.connection = None
+            self.idle.put(connection)
+
+    @contextmanager
+    def transaction(self):
+        """Hands this thread a connection inside a write transaction
+
+        The DB's write lock is taken up front (BEGIN IMMEDIATE), so nothing
+        else can write between our reads and our writes. The transaction
+        commits when the with block ends, or rolls back if it raises. Inside
+        another transaction on this thread, it's just part of that one.
+
+        Yields:
+            sqlite3.Connection
+        """
+        with self.connection() as connection:
+            if connection.in_transaction:
+                yield connection
+                return
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+
+
+pool = ConnectionPool(DATABASE, POOL_SIZE)
+
+# Metrics, scraped from GET /metrics
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled.", ["method", "route", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ["method", "route"]
+)
+IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled.")
+QUERY_SECONDS = Histogram(
+    "sqlite_query_duration_seconds", "cursor.execute latency.", ["statement"]
+)
+
+
+def execute(sql, params=()) -> sqlite3.Cursor:
+    """Runs a statement on a new cursor, timing it by statement type
+
+    Call it inside pool.connection(), so the connection is still this
+    thread's while the results are fetched.
+
+    Args:
+        sql (str)
+        params (tuple, optional): Defaults to ().
+
+    Returns:
+        sqlite3.Cursor
+    """
+    start = time.perf_counter()
+    try:
+        with pool.connection() as connection:
+            return connection.execute(sql, params)
+    finally:
+        QUERY_SECONDS.labels(sql.split(None, 1)[0].upper()).observe(
+            time.perf_counter() - start
+        )
+
+
+def executemany(sql, rows) -> sqlite3.Cursor:
+    """Runs a statement once per row of params, timing it like execute()
 
-# Create our in-memory DB and cursor
-db = sqlite3.connect("file::memory:?cache=shared", check_same_thread=False)
-cur = db.cursor()
+    Args:
+        sql (str)
+        rows (Iterable[tuple])
+
+    Returns:
+        sqlite3.Cursor
+    """
+    start = time.perf_counter()
+    try:
+        with pool.connection() as connection:
+            return connection.executemany(sql, rows)
+    finally:
+        QUERY_SECONDS.labels(sql.split(None, 1)[0].upper()).observe(
+            time.perf_counter() - start
+        )
+
+
+# Schema migrations. MIGRATIONS[n - 1] takes the DB from version n - 1 to
+# version n, and the DB's version lives in PRAGMA user_version. Only ever
+# append to this list: DBs out there are already at the older versions.
+MIGRATIONS = [
+    # 1: the original table
+    ["CREATE TABLE IF NOT EXISTS users(id, name, address, email, phone)"],
+    # 2: typed columns, keyed by id (so getUser is a b-tree lookup, not a
+    # table scan) and indexed on the columns users get looked up by
+    [
+        """CREATE TABLE users_v2(
+            id TEXT PRIMARY KEY NOT NULL,
+            name TEXT,
+            address TEXT,
+            email TEXT,
+            phone TEXT
+        ) WITHOUT ROWID""",
+        # Rows without an id can't be fetched anyway, and if an id was
+        # somehow inserted twice the first row wins
+        """INSERT OR IGNORE INTO users_v2(id, name, address, email, phone)
+            SELECT id, name, address, email, phone FROM users
+            WHERE id IS NOT NULL ORDER BY rowid""",
+        "DROP TABLE users",
+        "ALTER TABLE users_v2 RENAME TO users",
+        "CREATE INDEX users_name ON users(name)",
+        "CREATE INDEX users_email ON users(email)",
+        "CREATE INDEX users_phone ON users(phone)",
+    ],
+]
+
+
+def migrateDB(connection) -> int:
+    """Brings a DB's schema up to date by running the migrations it's missing
+
+    They all run in one transaction, so a DB is never left half migrated,
+    and the write lock is taken up front, so two processes starting at once
+    can't both migrate the same file.
+
+    Args:
+        connection (sqlite3.Connection)
+
+    Returns:
+        int: the schema version the DB is now at.
 
-# Create your table SQL statement
+    Raises:
+        RuntimeError: the DB is from a newer version of this code, with
+            migrations we don't know about. It's left as it is.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise RuntimeError(
+                f"DB schema is at version {version}, but we only know up to {len(MIGRATIONS)}"
+            )
+        for statements in MIGRATIONS[version:]:
+            for statement in statements:
+                connection.execute(statement)
+        # PRAGMA doesn't take parameters
+        connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return len(MIGRATIONS)
+
+
+# Create your table, or upgrade it
 def createDB():
-    cur.execute("CREATE TABLE users(id, name, address, email, phone)")
+    with pool.connection() as connection:
+        migrateDB(connection)
 
 
 # Create your table!
@@ -20,6 +247,34 @@ app = FastAPI()
 router = APIRouter(prefix="/api")
 
 
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    """Counts and times every request by the route template it matched
+    (e.g. "/api/get/user"), so raw URLs don't become metric labels"""
+    start = time.perf_counter()
+    status = 500
+    with IN_PROGRESS.track_inprogress():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "<unmatched>")
+            seconds = time.perf_counter() - start
+            REQUEST_SECONDS.labels(request.method, route).observe(seconds)
+            REQUESTS.labels(request.method, route, str(status)).inc()
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    """Endpoint for Prometheus to scrape
+
+    Returns:
+        Response: all metrics in the Prometheus text format.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @router.post("/add/user")
 def add_user(name, address=None, email=None, phone=None) -> dict:
     """Endpoint for creating a NEW user
@@ -33,8 +288,48 @@ def add_user(name, address=None, email=None, phone=None) -> dict:
     Returns:
         dict
     """
-    id = insertUser(name, address, email, phone)
-    return getUser(id)
+    return createUser(name, address, email, phone)
+
+
+def userFromRow(row) -> dict:
+    """Turns a users row into the user "obj" the endpoints return
+
+    Args:
+        row (tuple): id, name, address, email, phone.
+
+    Returns:
+        dict
+    """
+    return {
+        "user_id": row[0],
+        "user_name": row[1],
+        "user_address": row[2],
+        "user_email": row[3],
+        "user_phone": row[4],
+    }
+
+
+def createUser(name, address, email, phone, id=None) -> dict:
+    """Method for CREATING a NEW USER and getting it back in one statement
+
+    Args:
+        name (str)
+        address (str)
+        email (str)
+        phone (str)
+        id (str, optional): Defaults to a new uuid.
+
+    Returns:
+        dict: the new user.
+    """
+    params = (id or uuid.uuid4().hex, name, address, email, phone)
+    with pool.transaction():
+        user = execute(
+            "INSERT INTO users(id, name, address, email, phone) VALUES(?, ?, ?, ?, ?)"
+            " RETURNING *",
+            params,
+        ).fetchone()
+    return {user[0]: userFromRow(user)}
 
 
 def insertUser(name, address, email, phone) -> str:
@@ -49,54 +344,132 @@ def insertUser(name, address, email, phone) -> str:
     Returns:
         str: user_id
     """
-    user_id = uuid.uuid4().hex
-    params = (user_id, name, address, email, phone)
-    cur.execute(
-        "INSERT INTO users(id, name, address, email, phone) VALUES(?, ?, ?, ?, ?)",
-        params,
-    )
-    return user_id
+    return next(iter(createUser(name, address, email, phone)))
 
 
 @router.get("/get/all")
-def get_all_users(limit=10) -> list[dict]:
-    """Endpoint for getting ALL USERS
+def get_all_users(
+    response: Response,
+    limit: int | None = Query(None, ge=1),
+    after=None,
+    stream: bool = False,
+) -> list[dict]:
+    """Endpoint for getting ALL USERS, a page at a time, in id order
+
+    If the page is full, the X-Next-Cursor response header holds the id to
+    pass as after to get the next one. With stream=true, all the users
+    (after after, up to limit of them if given) are sent as newline
+    delimited JSON instead, without loading them all into memory.
 
     Args:
-        limit (int, optional): Defaults to 10.
+        limit (int, optional): at least 1, and at most MAX_PAGE unless
+            streaming. Defaults to 10 (or everything, when streaming).
+        after (str, optional): only users with ids after this. Defaults to None.
+        stream (bool, optional): Defaults to False.
 
     Returns:
         list[dict]: each dict in list is one entire user "obj".
     """
-    return getAllUsers(limit)
+    if stream:
+        return StreamingResponse(
+            ndjson(iterUsers(after, limit)), media_type="application/x-ndjson"
+        )
+    limit = 10 if limit is None else limit
+    if limit > MAX_PAGE:
+        raise HTTPException(
+            status_code=400, detail=f"A page holds at most {MAX_PAGE} users."
+        )
+    users = getAllUsers(limit, after)
+    if users and len(users) == limit:
+        response.headers["X-Next-Cursor"] = users[-1]["user_id"]
+    return users
+
+
+def ndjson(users, batch=500) -> Iterator[str]:
+    """Turns users into newline delimited JSON, batch lines per chunk, so a
+    big export isn't sent one tiny write per user
+
+    Args:
+        users (Iterator[dict])
+        batch (int, optional): Defaults to 500.
+
+    Yields:
+        str: up to batch lines of JSON.
+    """
+    lines = []
+    for user in users:
+        lines.append(json.dumps(user) + "\n")
+        if len(lines) == batch:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def userRows(cursor) -> sqlite3.Cursor:
+    """Makes a cursor's rows come back as user "objs" instead of tuples
+
+    Args:
+        cursor (sqlite3.Cursor)
+
+    Returns:
+        sqlite3.Cursor: the same cursor.
+    """
+    cursor.row_factory = lambda cursor, row: userFromRow(row)
+    return cursor
 
 
-def getAllUsers(limit=10) -> list[dict]:
-    """Method for GETTING ALL USERS
+def getAllUsers(limit=10, after=None) -> list[dict]:
+    """Method for GETTING ALL USERS, or a page of them
+
+    Pages are by id (WHERE id > after), not by OFFSET, so getting a page
+    deep into the table is a primary key search, not a scan from the top.
 
     Args:
         limit (int, optional): Defaults to 10.
+        after (str, optional): only users with ids after this. Defaults to None.
 
     Returns:
         list[dict]: each dict in list is one entire user "obj".
     """
-    res = cur.execute("SELECT * FROM users LIMIT ?", (limit,))
-    users = res.fetchall()
-    if users is not None:
-        all_users = []
-        for user in users:
-            all_users.append(
-                {
-                    "user_id": user[0],
-                    "user_name": user[1],
-                    "user_address": user[2],
-                    "user_email": user[3],
-                    "user_phone": user[4],
-                }
+    with pool.connection():
+        users = execute(
+            "SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            ("" if after is None else after, limit),
+        )
+        return userRows(users).fetchall()
+
+
+def iterUsers(after=None, limit=None, batch=500) -> Iterator[dict]:
+    """Method for GETTING every USER one at a time, in id order
+
+    Users are fetched batch at a time, and each batch is its own query that
+    picks up after the last id of the one before. So memory stays flat,
+    and no pooled connection is held while the caller (e.g. a slow client
+    of a streamed response) works through a batch.
+
+    Args:
+        after (str, optional): only users with ids after this. Defaults to None.
+        limit (int, optional): stop after this many. Defaults to all of them.
+        batch (int, optional): Defaults to 500.
+
+    Yields:
+        dict: one entire user "obj".
+    """
+    after = "" if after is None else after
+    while limit is None or limit > 0:
+        size = batch if limit is None else min(batch, limit)
+        with pool.connection():
+            users = execute(
+                "SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?", (after, size)
             )
-        return all_users
-    else:
-        return []
+            users = userRows(users).fetchmany(size)
+        yield from users
+        if len(users) < size:
+            return
+        after = users[-1]["user_id"]
+        if limit is not None:
+            limit -= len(users)
 
 
 @router.get("/get/user")
@@ -121,19 +494,10 @@ def getUser(id) -> dict | None:
     Returns:
         dict | None: return either dict or none.
     """
-    res = cur.execute("SELECT * from users WHERE id = ?", (id,))
-    user = res.fetchone()
+    with pool.connection():
+        user = execute("SELECT * from users WHERE id = ?", (id,)).fetchone()
     if user is not None:
-        return_user = {
-            user[0]: {
-                "user_id": user[0],
-                "user_name": user[1],
-                "user_address": user[2],
-                "user_email": user[3],
-                "user_phone": user[4],
-            }
-        }
-        return return_user
+        return {user[0]: userFromRow(user)}
     else:
         return None
 
@@ -155,17 +519,10 @@ def update_user(id, name=None, address=None, email=None, phone=None) -> dict:
     Returns:
         dict: returns updated user.
     """
-    user = getUser(id)
-    if user:
-        return updateUser(
-            id,
-            user[id]["user_name"] if name is None else name,
-            user[id]["user_address"] if address is None else address,
-            user[id]["user_email"] if email is None else email,
-            user[id]["user_phone"] if phone is None else phone,
-        )
-    else:
+    user = patchUser(id, name, address, email, phone)
+    if user is None:
         raise HTTPException(status_code=404, detail="No such user.")
+    return user
 
 
 def updateUser(id, user_name, user_add, user_email, user_phone) -> dict:
@@ -179,15 +536,96 @@ def updateUser(id, user_name, user_add, user_email, user_phone) -> dict:
         user_phone (str)
 
     Returns:
-        dict: returns updated user.
+        dict | None: returns updated user, or None if there's no such user.
     """
-    res = cur.execute(
-        "UPDATE users SET name = ?, email = ?, address = ?, phone = ? WHERE id = ?",
-        (user_name, user_email, user_add, user_phone, id),
-    )
-    db.commit()
+    with pool.transaction():
+        user = execute(
+            "UPDATE users SET name = ?, email = ?, address = ?, phone = ? WHERE id = ?"
+            " RETURNING *",
+            (user_name, user_email, user_add, user_phone, id),
+        ).fetchone()
+    if user is None:
+        return None
+    return {user[0]: userFromRow(user)}
 
-    return getUser(id)
+
+def patchUser(id, name, address, email, phone) -> dict | None:
+    """Method for UPDATING only the given fields of a USER, in one statement
+
+    Args:
+        id (str)
+        name (str | None): None leaves it as it is, and so on.
+        address (str | None)
+        email (str | None)
+        phone (str | None)
+
+    Returns:
+        dict | None: returns updated user, or None if there's no such user.
+    """
+    with pool.transaction():
+        user = execute(
+            "UPDATE users SET name = COALESCE(?, name), address = COALESCE(?, address),"
+            " email = COALESCE(?, email), phone = COALESCE(?, phone)"
+            " WHERE id = ? RETURNING *",
+            (name, address, email, phone, id),
+        ).fetchone()
+    if user is None:
+        return None
+    return {user[0]: userFromRow(user)}
+
+
+@router.put("/upsert/user")
+def upsert_user(
+    name, id=None, address=None, email=None, phone=None, update_existing: bool = True
+) -> dict:
+    """Endpoint for CREATING or UPDATING a USER in one request
+
+    Args:
+        name (str)
+        id (str, optional): Defaults to None.
+        address (str, optional): Defaults to None.
+        email (str, optional): Defaults to None.
+        phone (str, optional): Defaults to None.
+        update_existing (bool, optional): Defaults to True.
+
+    Returns:
+        dict: {"created": bool, "user": the user as it now is}.
+    """
+    created, user = upsertUser(id, name, address, email, phone, update_existing)
+    return {"created": created, "user": user}
+
+
+def upsertUser(id, name, address, email, phone, update_existing=True) -> tuple:
+    """Method for CREATING or UPDATING a USER atomically
+
+    The existing user is the one with this id, or if id is None, the first one
+    with this name. If there is one, its fields that aren't None get updated
+    (unless update_existing is False). If not, a new user is created, with
+    this id if one was given.
+
+    Args:
+        id (str | None)
+        name (str)
+        address (str | None)
+        email (str | None)
+        phone (str | None)
+        update_existing (bool, optional): Defaults to True.
+
+    Returns:
+        tuple: (created (bool), user (dict)).
+    """
+    # One transaction, so nobody can create or change the user in between
+    with pool.transaction():
+        if id is None:
+            row = execute("SELECT * FROM users WHERE name = ? LIMIT 1", (name,))
+        else:
+            row = execute("SELECT * FROM users WHERE id = ?", (id,))
+        existing = row.fetchone()
+        if existing is None:
+            return True, createUser(name, address, email, phone, id)
+        if not update_existing:
+            return False, {existing[0]: userFromRow(existing)}
+        return False, patchUser(existing[0], name, address, email, phone)
 
 
 @router.delete("/delete/user")
@@ -212,14 +650,202 @@ def deleteUser(id) -> str:
     Returns:
         str: returns "User {user_id} deleted."
     """
-    if getUser(id):
-        res = cur.execute("DELETE FROM users WHERE id = ?", (id,))
-        db.commit()
+    with pool.transaction():
+        deleted = execute("DELETE FROM users WHERE id = ? RETURNING id", (id,))
+        deleted = deleted.fetchone()
+    if deleted:
         return f"User {id} deleted."
     else:
         return "No such user."
 
 
+def existingIds(ids) -> set:
+    """Method for finding which of some ids belong to USERS
+
+    Args:
+        ids (list[str])
+
+    Returns:
+        set: the ids that are in the users table.
+    """
+    found = set()
+    with pool.connection():
+        # Stay well under SQLite's limit on ? params per statement
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            marks = ", ".join("?" * len(chunk))
+            rows = execute(f"SELECT id FROM users WHERE id IN ({marks})", chunk)
+            found.update(row[0] for row in rows)
+    return found
+
+
+def badField(user) -> str | None:
+    """Method for checking a user's fields before they go to the db, which
+    would store a number or a list just as happily as a string
+
+    Args:
+        user (dict)
+
+    Returns:
+        str | None: why the user can't be stored, or None if it can.
+    """
+    for field in ("id", "name", "address", "email", "phone"):
+        if user.get(field) is not None and not isinstance(user[field], str):
+            return f"The {field} has to be a string or null."
+    return None
+
+
+@router.post("/add/users")
+def add_users(users: list[dict] = Body()) -> list[dict]:
+    """Endpoint for creating many NEW users in one go
+
+    Args:
+        users (list[dict]): each has a name, and may have an address, email,
+            phone and id.
+
+    Returns:
+        list[dict]: one result per user, in order (see insertUsers).
+    """
+    return insertUsers(users)
+
+
+def insertUsers(users) -> list[dict]:
+    """Method for CREATING many NEW USERS in one transaction
+
+    Users without a name, with a field that isn't a string, or with an id
+    that's taken (or repeated), are skipped and the rest are inserted with
+    one executemany.
+
+    Args:
+        users (list[dict])
+
+    Returns:
+        list[dict]: {"user_id": id, "created": True} per user, or
+            {"user_id": id, "created": False, "error": why} if it was skipped.
+    """
+    results, pending = [], []
+    for user in users:
+        result = {"user_id": user.get("id") or uuid.uuid4().hex}
+        results.append(result)
+        error = badField(user)
+        if error:
+            result.update(created=False, error=error)
+        elif user.get("name"):
+            fields = (user.get("address"), user.get("email"), user.get("phone"))
+            pending.append((result, (result["user_id"], user["name"], *fields)))
+        else:
+            result.update(created=False, error="A user needs a name.")
+    with pool.transaction():
+        # Only ids we were given can be taken already; new uuids aren't
+        given = [user["id"] for user in users if user.get("id") and not badField(user)]
+        taken = existingIds(given)
+        rows = []
+        for result, row in pending:
+            if row[0] in taken:
+                result.update(created=False, error="That id is taken.")
+            else:
+                result["created"] = True
+                taken.add(row[0])
+                rows.append(row)
+        executemany(
+            "INSERT INTO users(id, name, address, email, phone) VALUES(?, ?, ?, ?, ?)",
+            rows,
+        )
+    return results
+
+
+@router.patch("/update/users")
+def update_users(updates: list[dict] = Body()) -> list[dict]:
+    """Endpoint for UPDATING many EXISTING users in one go
+
+    Args:
+        updates (list[dict]): each has an id, and the fields to change.
+
+    Returns:
+        list[dict]: one result per update, in order (see updateUsers).
+    """
+    return updateUsers(updates)
+
+
+def updateUsers(updates) -> list[dict]:
+    """Method for UPDATING only the given fields of many USERS, in one
+    transaction with one executemany
+
+    Args:
+        updates (list[dict]): each has an id, and any of name, address,
+            email and phone. Fields that are missing or None are left as is.
+
+    Returns:
+        list[dict]: {"user_id": id, "updated": bool} per update, with an
+            "error" if it was skipped for having no id or a field that isn't
+            a string.
+    """
+    results, pending = [], []
+    for update in updates:
+        result = {"user_id": update.get("id")}
+        results.append(result)
+        error = badField(update)
+        if error:
+            result.update(updated=False, error=error)
+        elif update.get("id") is None:
+            result.update(updated=False, error="An update needs an id.")
+        else:
+            pending.append((result, update))
+    with pool.transaction():
+        found = existingIds([update["id"] for result, update in pending])
+        executemany(
+            "UPDATE users SET name = COALESCE(?, name), address = COALESCE(?, address),"
+            " email = COALESCE(?, email), phone = COALESCE(?, phone) WHERE id = ?",
+            (
+                (
+                    update.get("name"),
+                    update.get("address"),
+                    update.get("email"),
+                    update.get("phone"),
+                    update["id"],
+                )
+                for result, update in pending
+                if update["id"] in found
+            ),
+        )
+    for result, update in pending:
+        result["updated"] = update["id"] in found
+    return results
+
+
+@router.delete("/delete/users")
+def delete_users(ids: list[str] = Body()) -> list[dict]:
+    """Endpoint for DELETING many USERS in one go
+
+    Args:
+        ids (list[str])
+
+    Returns:
+        list[dict]: one result per id, in order (see deleteUsers).
+    """
+    return deleteUsers(ids)
+
+
+def deleteUsers(ids) -> list[dict]:
+    """Method for DELETING many USERS in one transaction with one executemany
+
+    Args:
+        ids (list[str])
+
+    Returns:
+        list[dict]: {"user_id": id, "deleted": bool} per id. Only the first
+            of a repeated id counts as deleted.
+    """
+    with pool.transaction():
+        found = existingIds(ids)
+        executemany("DELETE FROM users WHERE id = ?", ((id,) for id in found))
+    results = []
+    for id in ids:
+        results.append({"user_id": id, "deleted": id in found})
+        found.discard(id)
+    return results
+
+
 # UNIT TESTS
 class MyTests(unittest.TestCase):
     def test_getUser(self):
@@ -278,6 +904,115 @@ class MyTests(unittest.TestCase):
 
         assert len(users) == 2, "bad length"
 
+    def test_upsertUser(self):
+        # Upserting a new name creates the user
+        created, user = upsertUser(None, "Upsy", "1 Road", None, None)
+        user_id = next(iter(user))
+        assert created, "test failed, user not created"
+        assert user[user_id]["user_address"] == "1 Road", "test failed, address wrong"
+
+        # Upserting the same name again updates only the fields given
+        created, user = upsertUser(None, "Upsy", None, "up@test.com", None)
+        assert not created, "test failed, user created twice"
+        assert user[user_id]["user_address"] == "1 Road", "test failed, address lost"
+        assert user[user_id]["user_email"] == "up@test.com", "test failed, email wrong"
+
+        # Unless we ask it to leave existing users alone
+        created, user = upsertUser(user_id, "Upsy", "2 Road", None, None, False)
+        assert not created, "test failed, user created twice"
+        assert user[user_id]["user_address"] == "1 Road", "test failed, user updated"
+
+        deleteUser(user_id)
+
+    def test_migrateDB(self):
+        # A DB made before migrations existed: untyped, no key, dupe ids
+        old_db = sqlite3.connect(":memory:")
+        old_db.execute("CREATE TABLE users(id, name, address, email, phone)")
+        old_db.executemany(
+            "INSERT INTO users VALUES(?, ?, ?, ?, ?)",
+            [("a", "Tim", None, "t@test.com", None), ("a", "Dupe", None, None, None)],
+        )
+        old_db.commit()
+
+        assert migrateDB(old_db) == len(MIGRATIONS), "test failed, wrong version"
+        rows = old_db.execute("SELECT id, name, email FROM users").fetchall()
+        assert rows == [("a", "Tim", "t@test.com")], "test failed, rows lost"
+
+        # id is the key now
+        with self.assertRaises(sqlite3.IntegrityError):
+            old_db.execute("INSERT INTO users(id, name) VALUES('a', 'Again')")
+        old_db.rollback()
+
+        # Migrating again does nothing
+        assert migrateDB(old_db) == len(MIGRATIONS), "test failed, wrong version"
+
+        # A DB from a newer version is refused and left at its version
+        old_db.execute(f"PRAGMA user_version = {len(MIGRATIONS) + 1}")
+        with self.assertRaises(RuntimeError):
+            migrateDB(old_db)
+        version = old_db.execute("PRAGMA user_version").fetchone()[0]
+        assert version == len(MIGRATIONS) + 1, "test failed, version lowered"
+
+    def test_bulk(self):
+        results = insertUsers(
+            [
+                {"name": "Bulk 1", "email": "bulk@test.com"},
+                {"name": "Bulk 2", "id": "bulk-2"},
+                {"name": "Bulk 2 again", "id": "bulk-2"},
+                {"email": "nameless@test.com"},
+            ]
+        )
+        created = [result["created"] for result in results]
+        assert created == [True, True, False, False], "test failed, bad results"
+        ids = [results[0]["user_id"], "bulk-2"]
+        assert getUser("bulk-2")["bulk-2"]["user_name"] == "Bulk 2", "test failed"
+
+        # Only the fields given change, and unknown ids are reported
+        results = updateUsers([{"id": ids[0], "phone": "555"}, {"id": "nope"}])
+        updated = [result["updated"] for result in results]
+        assert updated == [True, False], "test failed, bad results"
+        user = getUser(ids[0])[ids[0]]
+        assert user["user_phone"] == "555", "test failed, phone not updated"
+        assert user["user_email"] == "bulk@test.com", "test failed, email lost"
+
+        # Fields that aren't strings, and updates without an id, are reported
+        results = insertUsers([{"name": "Bulk 3", "phone": 555}, {"name": ["Bulk"]}])
+        created = [result["created"] for result in results]
+        assert created == [False, False], "test failed, bad results"
+        assert all(result["error"] for result in results), "test failed, no error"
+        results = updateUsers([{"phone": "555"}, {"id": ids[0], "email": 1}])
+        updated = [result["updated"] for result in results]
+        assert updated == [False, False], "test failed, bad results"
+        assert results[0]["user_id"] is None, "test failed, missing id made up"
+        assert getUser(ids[0])[ids[0]]["user_email"] == "bulk@test.com", "test failed"
+
+        results = deleteUsers(ids + ["nope"])
+        deleted = [result["deleted"] for result in results]
+        assert deleted == [True, True, False], "test failed, bad results"
+        assert getUser(ids[0]) is None, "test failed, user not deleted"
+
+    def test_pages(self):
+        ids = [insertUser(f"Pager {i}", None, None, None) for i in range(5)]
+
+        # Walk the pages the way a client would
+        paged = []
+        page = getAllUsers(2)
+        while page:
+            paged += [user["user_id"] for user in page]
+            page = getAllUsers(2, page[-1]["user_id"])
+        assert paged == sorted(paged), "test failed, pages out of order"
+        assert set(ids) <= set(paged), "test failed, users missing"
+        assert len(paged) == len(set(paged)), "test failed, users repeated"
+
+        # Streaming gives the same users, in small batches or not
+        streamed = [user["user_id"] for user in iterUsers(batch=2)]
+        assert streamed == paged, "test failed, stream differs"
+        some = [user["user_id"] for user in iterUsers(paged[0], limit=3, batch=2)]
+        assert some == paged[1:4], "test failed, stream limit wrong"
+
+        for user_id in ids:
+            deleteUser(user_id)
+
 
 # App must INCLUDE all above ROUTER ENDPOINTS
 app.include_router(router=router)
@@ -1,34 +1,63 @@
+import argparse
+import atexit
+import os
+import queue
 import re
 import sqlite3
+import threading
+import time
+import unittest
 from pprint import pprint
 from typing import List, Union
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
 import chromedriver_autoinstaller
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.common.exceptions import (ElementClickInterceptedException,
                                         NoSuchElementException)
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
+from urllib3.util.retry import Retry
 
 
-chrome_options = Options()
-chrome_options.set_capability("pageLoadStrategy", "eager")
+START_URL = "https://www.guitartabs.cc/tabs/0-9/"
 
-# # Add headless argument
-# chrome_options.add_argument("--headless")
 
-# # Other arguments to improve performance
-# chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
-chrome_options.add_argument("--window-size=1920x1080")
+def make_driver(headless: bool = False) -> webdriver.Chrome:
+    """
+    Dis makes a driver, it drives a browser.
+    The parallel workers each get a headless one, so we don't get a pile of Chrome windows
+    """
+    chrome_options = Options()
+    chrome_options.set_capability("pageLoadStrategy", "eager")
+
+    if headless:
+        # Add headless argument
+        chrome_options.add_argument("--headless=new")
+
+        # Other arguments to improve performance
+        chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--window-size=1920x1080")
+    return webdriver.Chrome(options=chrome_options)
 
 
 DB_FILENAME = "song_data.db"
 
-con = sqlite3.connect(DB_FILENAME)
+# When scraping in parallel, the writer thread is the only one that uses this connection
+# (the workers each open their own to claim hrefs from the frontier)
+con = sqlite3.connect(DB_FILENAME, check_same_thread=False)
 cur = con.cursor()
+# WAL means a commit doesn't have to rewrite the db file, and synchronous=NORMAL
+# means it doesn't fsync on every commit either (a crash can only lose the last
+# few commits, never corrupt the db)
+cur.execute("PRAGMA journal_mode=WAL")
+cur.execute("PRAGMA synchronous=NORMAL")
 
 # cur.execute("INSERT INTO songs (title, artist, tuning, chords) VALUES (...)")
 
@@ -85,82 +114,205 @@ def init_db():
         drop_tables(tables)
         init_db_schema()
 
+    # The hrefs the parallel scraper still has to visit (see the frontier section below)
+    # priority says which kind of page to do first: songs (0), then artists (1), then listings (2)
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS frontier("
+        "href text PRIMARY KEY, kind text NOT NULL, priority integer NOT NULL, "
+        "claimed integer NOT NULL DEFAULT 0)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS frontier_claim ON frontier(claimed, priority)"
+    )
+    con.commit()
+
 
 init_db()
 
 
+class SongWriter:
+    """
+    This holds on to scraped artists, chords, songs, chord joins, scraped pages and newly found hrefs
+    and writes them to the db in batches
+    Each batch is one transaction with an executemany per table, instead of a commit for every row
+    It flushes once it has flush_every songs, once flush_seconds have gone by since the last flush, and at exit
+    Artist, chord and song ids get handed out here, counting up from the biggest id in the db,
+    so we can queue up a song's chord joins before anything is written, and the db is only ever
+    written to (and locked) during a flush
+    That means only one SongWriter (one process) can be writing to the db at a time
+    """
+
+    def __init__(self, flush_every: int = 50, flush_seconds: float = 10.0):
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.artists: list[tuple] = []
+        self.chords: list[tuple] = []
+        self.songs: list[tuple] = []
+        self.joins: list[tuple] = []
+        self.pages: list[tuple] = []
+        self.links: list[tuple] = []
+        self.next_artist_id = self.next_id("artists")
+        self.next_chord_id = self.next_id("chords")
+        self.next_song_id = self.next_id("songs")
+        self.last_flush = time.monotonic()
+
+    @staticmethod
+    def next_id(table: str) -> int:
+        return cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+    def add_artist(self, artist: str) -> int:
+        """
+        Queues up a new artist and returns the id it will have
+        """
+        artistID = self.next_artist_id
+        self.next_artist_id += 1
+        self.artists.append((artistID, artist))
+        return artistID
+
+    def add_chord(self, chord: str) -> int:
+        """
+        Queues up a new chord and returns the id it will have
+        """
+        chordID = self.next_chord_id
+        self.next_chord_id += 1
+        self.chords.append((chordID, chord))
+        return chordID
+
+    def add_song(self, artistID: int, title: str, tuning: str) -> int:
+        """
+        Queues up a song and returns the id it will have
+        """
+        songID = self.next_song_id
+        self.next_song_id += 1
+        self.songs.append((songID, str(artistID), str(title), str(tuning)))
+        return songID
+
+    def add_join(self, chordID: int, songID: int) -> None:
+        self.joins.append((str(chordID), str(songID)))
+
+    def add_links(self, links: list[tuple[str, str]]) -> None:
+        """
+        Queues up (href, kind) pairs found on a page, to go into the frontier
+        """
+        self.links.extend((href, kind, PRIORITIES[kind], href) for href, kind in links)
+
+    def add_page(self, href: str) -> None:
+        """
+        Queues up a scraped page, and since a page is done once it's queued, this is where we check if it's time to flush
+        """
+        self.pages.append((str(href),))
+        if (
+            len(self.songs) >= self.flush_every
+            or time.monotonic() - self.last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes everything queued up in one commit
+        """
+        try:
+            cur.executemany("INSERT INTO artists (id, artist) VALUES (?, ?)", self.artists)
+            cur.executemany("INSERT INTO chords (id, chord) VALUES (?, ?)", self.chords)
+            cur.executemany(
+                "INSERT INTO songs (id, artistID, title, tuning) VALUES (?, ?, ?, ?)",
+                self.songs,
+            )
+            cur.executemany(
+                "INSERT INTO join_chord_song (chordID, songID) VALUES (?, ?)", self.joins
+            )
+            # A page can only be scraped once, so if it's somehow there already we just leave it
+            cur.executemany(
+                "INSERT OR IGNORE INTO scraped_pages (href) VALUES (?)", self.pages
+            )
+            # Scraped pages are done, so they come off the frontier
+            cur.executemany("DELETE FROM frontier WHERE href = ?", self.pages)
+            # And new hrefs go on it, unless we've already scraped them (or they're on it already)
+            cur.executemany(
+                """
+                INSERT INTO frontier (href, kind, priority)
+                SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM scraped_pages WHERE href = ?)
+                ON CONFLICT do nothing
+                """,
+                self.links,
+            )
+            con.commit()
+        except BaseException:
+            # Leave the db as it was before this batch, rather than half of it waiting in an open transaction,
+            # and keep the batch queued
+            con.rollback()
+            raise
+        for queued in (self.artists, self.chords, self.songs, self.joins, self.pages, self.links):
+            queued.clear()
+        self.last_flush = time.monotonic()
+
+
+song_writer = SongWriter()
+# Whatever's still queued when we stop (done, crashed or ctrl-c) gets written
+atexit.register(song_writer.flush)
+
+# Name -> id for every artist and chord in the db, so looking one up that we've seen before costs no queries
+# There's only a few hundred chords, and they come up over and over
+artist_ids: dict[str, int] = {}
+chord_ids: dict[str, int] = {}
+
+
+def warm_id_caches() -> None:
+    """
+    This loads every artist and chord already in the db into artist_ids and chord_ids
+    """
+    artist_ids.update(
+        (artist, id) for id, artist in cur.execute("SELECT id, artist FROM artists")
+    )
+    chord_ids.update(
+        (chord, id) for id, chord in cur.execute("SELECT id, chord FROM chords")
+    )
+
+
+warm_id_caches()
+
+
 def insert_artist(artist: str) -> int:
     """
     This takes an artist(str) and adds it to db
-    SQL statement return UId
     Func returns id
+    It gets written with the next song_writer flush
+    If we've seen the artist before, the id comes out of artist_ids and we don't touch the db
+    artist_ids has every artist in the db, so if it's not in there it's new
     """
-    id = cur.execute(
-        f"""
-        INSERT INTO artists (artist) VALUES (?)
-        ON CONFLICT do nothing
-        RETURNING id;
-        """,
-        (artist,),
-    ).fetchone()
-    if id is None:
-        id = cur.execute(
-            "SELECT id FROM artists WHERE artist=(?)", (artist,)
-        ).fetchone()
-
-    con.commit()
-    return id[0]
+    if artist not in artist_ids:
+        artist_ids[artist] = song_writer.add_artist(artist)
+    return artist_ids[artist]
 
 
 def insert_song(artistID: int, title: str, tuning: str) -> int:
     """
     Given artistID, title, and tuning
-    We attempt insert song into db
+    We queue up the song to go into the db with the next flush
     Returning id of song
     """
-    id = cur.execute(
-        f"""
-        INSERT INTO songs (artistID, title, tuning) VALUES (?, ?, ?)
-        RETURNING id;
-        """,
-        (str(artistID), str(title), str(tuning)),
-    ).fetchone()
-    con.commit()
-    return id[0]
+    return song_writer.add_song(artistID, title, tuning)
 
 
 def insert_chord(chord: str) -> int:
     """
     We insert chord into chord table
     Returning chordID
+    It gets written with the next song_writer flush
+    If we've seen the chord before, the id comes out of chord_ids and we don't touch the db
+    chord_ids has every chord in the db, so if it's not in there it's new
     """
-    id = cur.execute(
-        f"""
-        INSERT INTO chords (chord) VALUES (?)
-        ON CONFLICT do nothing
-        RETURNING id;
-        """,
-        (chord,),
-    ).fetchone()
-    if id is None:
-        id = cur.execute("SELECT id FROM chords WHERE chord=(?)", (chord,)).fetchone()
-    con.commit()
-    return id[0]
+    if chord not in chord_ids:
+        chord_ids[chord] = song_writer.add_chord(chord)
+    return chord_ids[chord]
 
 
 def insert_join(chordID: int, songID: int) -> None:
     """
-    We insert join data (chordID, songID) into join table
+    We queue up join data (chordID, songID) to go into join table with the next flush
     No return
     """
-    cur.execute(
-        f"""
-        INSERT INTO join_chord_song (chordID, songID)
-        VALUES (?, ?);
-        """,
-        (str(chordID), str(songID)),
-    )
-    con.commit()
+    song_writer.add_join(chordID, songID)
 
 
 def insert_song_data(artist: str, title: str, tuning: str, chords: tuple[str,...]) -> None:
@@ -189,6 +341,8 @@ def get_all_scraped_pages() -> set[str]:
     Returns:
         set[str]: Each string is a url of a page that has been checked
     """
+    # Write out the pages still queued up so they're in there too
+    song_writer.flush()
     return {
         href[0] for href in cur.execute(f"SELECT href FROM scraped_pages").fetchall()
     }
@@ -197,15 +351,12 @@ def get_all_scraped_pages() -> set[str]:
 def add_scraped_page(href: str) -> None:
     """
     This adds an href (url) to the scraped pages table to show we have already checked it
+    It goes in with the next song_writer flush, in the same commit as the songs scraped from it
 
     Args:
         href (str): A URL of a page that has just been scraped
     """
-    try:
-        cur.execute("INSERT INTO scraped_pages (href) VALUES (?)", (str(href),))
-        con.commit()
-    except sqlite3.IntegrityError as exc:
-        print("Failed to add href: ", exc)
+    song_writer.add_page(href)
 
 
 def analysis_chord_counts() -> list[dict]:
@@ -225,23 +376,11 @@ def analysis_chord_counts() -> list[dict]:
     ]
 
 
-previously_scraped_pages = get_all_scraped_pages()
-
-chromedriver_autoinstaller.install()
-
-
-# Dis my driver, it drives the browser.
-driver = webdriver.Chrome(options=chrome_options)
-driver.get("https://www.guitartabs.cc/tabs/0-9/")
-
-# Dis my actions, it allows me to interact with the webpage.
-actions = ActionChains(driver)
-link = driver.find_element(
-    By.XPATH, "//*[@id='main_content']/table[1]/tbody/tr/td[2]/div[2]/div/div/div/a[1]"
-).click()
+# The pages we've already scraped, so we can skip them
+previously_scraped_pages: set[str] = set()
 
 
-def click_safe(element) -> bool:
+def click_safe(driver, element) -> bool:
     """
     This function takes an argument of a web element, tries to click it
     Returns a boolean depending on the outcome of the click.
@@ -268,66 +407,165 @@ def chords_valid(chords: List[str]) -> bool:
 
 tuning_pattern = re.compile(r"Tuning\:?\s?(?P<tuning>.*)?$", re.MULTILINE)
 
+# Where the details are on a song page. The artist and song name are towards top right of page,
+# the chords are in the popup box (each chord is held in a td element), and the tuning is somewhere
+# in the text body of the tab.
+ARTIST_XPATH = "//*[@id='main_content']/table[2]/tbody/tr[1]/td[2]/div/a[3]"
+TITLE_XPATH = "//*[@id='main_content']/table[2]/tbody/tr[1]/td[2]/div/a[4]"
+CHORDS_XPATH = "//*[@class='crd']/center"
+TUNING_XPATH = "//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/div/div[4]/font/pre"
 
-def find_song_details() -> None:
+
+def song_details(artist_name: str, song_title: str, chord_strings: List[str], tuning_text: str) -> Union[dict, None]:
     """
-    This function can run when you are on a page of a song itself
-    It attempts to get to artist name, song title, tuning, and chords
-    When it's done it prints the song details that were found (or not found)
+    This takes what we found on a song page, however we found it, and prints the song details that were found (or not found)
+    It returns the details as a dict (the args for insert_song_data), or None if the song is no good
     """
 
-    # Find the artist name towards top right of page, get the text and strip the suffix off the end
-    artist_name = driver.find_element(
-        By.XPATH, "//*[@id='main_content']/table[2]/tbody/tr[1]/td[2]/div/a[3]"
-    ).text.removesuffix(" tabs")
+    # Get rid of the suffixes on the end of the artist and song names
+    artist_name = artist_name.removesuffix(" tabs")
+    song_title = song_title.removesuffix(" Chords")
+
+    # We need to ensure that the chords are actual chords: for example "h" is not a chord, but appeared in an edge case i happened upon
+    if not chords_valid(chord_strings):
+        # This indicates there was bad data in this song (invalid chords) and dismisses that entry
+        print("Song is pooched: ", song_title)
+        return None
+
+    # Let's print the data we've collected so far
+    print("Artist Name: " + artist_name)
+    print("Song Title: " + song_title)
+    print("Chords: ")
+    print(chord_strings)
+
+    # We are using tuning_pattern (a regex statement) to parse out the tuning from the text body
+    tuning_match = tuning_pattern.search(tuning_text)
+
+    # If we find the tuning on the page, we print it, otherwise we skip
+    tuning_string = ""
+    if tuning_match and tuning_match.group("tuning"):
+        print("Tuning: ", tuning_match.group("tuning"))
+        tuning_string = tuning_match.group("tuning")
+
+    return {
+        "artist": artist_name,
+        "title": song_title,
+        "tuning": tuning_string,
+        "chords": chord_strings,
+    }
 
-    # Find the song name towards top right of page, get the text and strip the suffix off the end
-    song_title = driver.find_element(
-        By.XPATH, "//*[@id='main_content']/table[2]/tbody/tr[1]/td[2]/div/a[4]"
-    ).text.removesuffix(" Chords")
 
-    # Find the chords by checking the popup box, each chord is held in a td element
-    chords = driver.find_elements(By.XPATH, "//*[@class='crd']/center")
+def find_song_details(driver) -> Union[dict, None]:
+    """
+    This function can run when you are on a page of a song itself
+    It attempts to get to artist name, song title, tuning, and chords, and hands them to song_details()
+    """
+    artist_name = driver.find_element(By.XPATH, ARTIST_XPATH).text
+    song_title = driver.find_element(By.XPATH, TITLE_XPATH).text
 
     # Chords is a list of Webelements. We need to transform into strings so we can validate and manipulate them.
-    chord_strings = [x.text for x in chords]
+    chord_strings = [x.text for x in driver.find_elements(By.XPATH, CHORDS_XPATH)]
 
-    # We need to ensure that the chords are actual chords: for example "h" is not a chord, but appeared in an edge case i happened upon
-    if chords_valid(chord_strings):
-        # Let's print the data we've collected so far
-        print("Artist Name: " + artist_name)
-        print("Song Title: " + song_title)
-        print("Chords: ")
-        print(chord_strings)
-
-        # Here we get the text body that contains the Tuning of the song, unfortunately it is the entire boday of the page.
-        tuning = driver.find_element(
-            By.XPATH,
-            "//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/div/div[4]/font/pre",
-        )
+    # Here we get the text body that contains the Tuning of the song, unfortunately it is the entire boday of the page.
+    tuning = driver.find_elements(By.XPATH, TUNING_XPATH)
 
-        # We are using tuning_pattern (a regex statement) to parse out the tuning from the tuning element we grabbed
-        tuning_match = tuning_pattern.search(tuning.text)
+    return song_details(artist_name, song_title, chord_strings, tuning[0].text if tuning else "")
 
-        # If we find the tuning on the page, we print it, otherwise we skip
-        tuning_string = ""
-        if tuning_match and tuning_match.group("tuning"):
-            print("Tuning: ", tuning_match.group("tuning"))
-            tuning_string = tuning_match.group("tuning")
 
-        insert_song_data(
-            artist=artist_name,
-            title=song_title,
-            tuning=tuning_string,
-            chords=chord_strings,
-        )
+# The fast path
+# Everything find_song_details() needs is in the html the server sends, so we can download a song page
+# with plain http and pick the details out of it with lxml, no browser (and no round trip to the browser
+# for every element) needed. If that doesn't work out for a page, we fall back to the browser.
 
-    # This else indicates there was bad data in this song (invalid chords) and dismisses that entry
-    else:
-        print("Song is pooched: ", song_title)
+
+class SongParseError(Exception):
+    """
+    The page didn't look like a song page to parse_song_html()
+    """
+
+
+def xpath_html(tree: lxml.html.HtmlElement, xpath: str) -> list:
+    """
+    Runs one of our xpaths against a page parsed by lxml
+    Browsers add a tbody to every table, so the xpaths have them, but lxml only has them if the html does,
+    so if we find nothing we try again without them
+    """
+    return tree.xpath(xpath) or tree.xpath(xpath.replace("/tbody", ""))
+
+
+def parse_song_html(html: Union[str, bytes]) -> Union[dict, None]:
+    """
+    This is find_song_details() for the html of a song page, which we parse with lxml instead of asking the browser
+    It raises SongParseError if it can't find the artist, title or chords
+    """
+    try:
+        tree = lxml.html.fromstring(html)
+    except lxml.etree.ParserError as exc:
+        # An empty page (or one with nothing but whitespace or comments) isn't a document to lxml
+        raise SongParseError(str(exc)) from exc
+
+    artist = xpath_html(tree, ARTIST_XPATH)
+    title = xpath_html(tree, TITLE_XPATH)
+    # text_content() keeps the whitespace from the html, where the browser's text doesn't
+    chord_strings = [" ".join(x.text_content().split()) for x in xpath_html(tree, CHORDS_XPATH)]
+    if not artist or not title or not chord_strings:
+        raise SongParseError("no artist, title or chords on this page")
+
+    tuning = xpath_html(tree, TUNING_XPATH)
+
+    return song_details(
+        artist[0].text_content().strip(),
+        title[0].text_content().strip(),
+        chord_strings,
+        tuning[0].text_content() if tuning else "",
+    )
+
+
+# Some sites don't like python-requests, so we say we're chrome
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36"
+
+
+def make_session(pool_size: int = 1) -> requests.Session:
+    """
+    Dis makes an http session. It keeps connections to the site open between pages,
+    and retries a few times when the site's having a bad moment
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_page(session: requests.Session, href: str) -> bytes:
+    """
+    This downloads the html at href. href can also be a saved page (a file:// url or a path), so we can try the parsing offline
+    """
+    if href.startswith("file://"):
+        href = url2pathname(urlparse(href).path)
+    if os.path.exists(href):
+        with open(href, "rb") as page:
+            return page.read()
+    response = session.get(href, timeout=15)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_song_details(session: requests.Session, href: str) -> Union[dict, None]:
+    """
+    This downloads a song page and parses it with parse_song_html()
+    It raises SongParseError if it couldn't, in which case you'll want to use the browser instead
+    """
+    try:
+        html = load_page(session, href)
+    except (OSError, requests.RequestException) as exc:
+        raise SongParseError(f"couldn't download {href}: {exc}") from exc
+    return parse_song_html(html)
 
 
-def find_xpath_safe(xpath: str) -> Union[WebElement, None]:
+def find_xpath_safe(driver, xpath: str) -> Union[WebElement, None]:
     """
     This function takes an arg of an xpath (str) and attempts to find it on the page.
     If it finds the element it returns the element, otherwise handles exception by returning None
@@ -341,93 +579,84 @@ def find_xpath_safe(xpath: str) -> Union[WebElement, None]:
         return None
 
 
-def scrape_artist_songs() -> None:
+# The links in the table on a page of artists, or on a page of an artist's songs (row 1 is the header)
+LISTING_LINKS_XPATH = "//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/table/tbody/tr[position() > 1]/td[2]/a"
+
+
+def collect_listing_hrefs(driver) -> list[str]:
     """
-    This function takes place on a page of an artist's songs
-    It loops thru each element, which is a song, on the page and attempts to load on it
-    If it loads a song, it clicks a checkbox that opens a dialogue box that contains the chords for that song
-    It then attempts to gather the song's details before navigating back and moving on to the next song
+    This grabs the href of every artist (or song) in the table on this page, all in one go
     """
+    return [
+        element.get_attribute("href")
+        for element in driver.find_elements(By.XPATH, LISTING_LINKS_XPATH)
+    ]
 
-    # This captures how many songs are on this specific page
-    table_row_count = len(
-        driver.find_elements(
-            By.XPATH,
-            "//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/table/tbody/tr[*]",
-        )
-    )
 
-    # For every song
-    for i in range(2, table_row_count + 1):
+def dismiss_footer(driver) -> None:
+    """
+    This clicks away the footer that pops up over the page, if it's there
+    """
+    footer_button = find_xpath_safe(
+        driver, "//*[@id='body']/div[2]/div/div/div/div/footer/button[1]"
+    )
+    if footer_button:
+        click_safe(driver, footer_button)
 
-        # Attempt to get the link for this song
-        song_xpath = f"//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/table/tbody/tr[{i}]/td[2]/a"
-        song_element = find_xpath_safe(song_xpath)
 
-        # If we find it
-        if song_element:
-            href = song_element.get_attribute("href")
-            if href in previously_scraped_pages:
-                print("Skipping this href, already scanned: ", href)
-                continue
-            # And if we can load it
-            if not click_safe(song_element):
-                continue
-            # We find the checkbox to show the chords to the song
-            checkbox_xpath = '//*[@id="showing_chords_down"]'
-            checkbox = find_xpath_safe(checkbox_xpath)
+def scrape_song(driver, href: str, session: Union[requests.Session, None] = None) -> Union[dict, None]:
+    """
+    A song page: we download and parse it if we have an http session,
+    otherwise (or if that doesn't work) we load it, show the chords and gather the song's details
+    """
+    if session:
+        try:
+            return fetch_song_details(session, href)
+        except SongParseError as exc:
+            print("Couldn't get the song without the browser: ", exc)
+    driver.get(href)
+    checkbox = find_xpath_safe(driver, '//*[@id="showing_chords_down"]')
+    if checkbox and click_safe(driver, checkbox):
+        return find_song_details(driver)
+    return None
 
-            # And click it
-            if checkbox and click_safe(checkbox):
 
-                # Gather all the details
-                find_song_details()
+def scrape_artist_songs(driver, session: Union[requests.Session, None] = None) -> None:
+    """
+    This function takes place on a page of an artist's songs
+    It grabs the links to all of the songs on the page in one go, and goes straight to each one we haven't scraped yet
+    with scrape_song(), so we never have to come back to this page
+    """
+    for href in collect_listing_hrefs(driver):
+        if href in previously_scraped_pages:
+            print("Skipping this href, already scanned: ", href)
+            continue
 
-            add_scraped_page(href=href)
+        # Gather all the details
+        song = scrape_song(driver, href, session)
+        if song:
+            insert_song_data(**song)
 
-            # Navigate back and continue
-            driver.back()
+        add_scraped_page(href=href)
 
 
-def scrape_artists() -> None:
+def scrape_artists(driver, session: Union[requests.Session, None] = None) -> None:
     """
     This function takes place on a page with a list of artists
-    It attempts to load each of them
+    It grabs the links to all of the artists on the page in one go, and goes straight to each one we haven't scraped yet
     """
-    footer_button = find_xpath_safe(
-        "//*[@id='body']/div[2]/div/div/div/div/footer/button[1]"
-    )
-    if footer_button:
-        click_safe(footer_button)
-
-    # This captures how many artists are on this specific page
-    table_row_count = len(
-        driver.find_elements(
-            By.XPATH,
-            "//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/table/tbody/tr[*]",
-        )
-    )
+    dismiss_footer(driver)
 
     # For every artist
-    for i in range(2, table_row_count + 1):
-
-        # Get the link to their songs
-        artist_xpath = f"//*[@id='main_content']/table[2]/tbody/tr[2]/td[2]/div[2]/div[2]/table/tbody/tr[{i}]/td[2]/a"
-        artist_element = find_xpath_safe(artist_xpath)
+    for i, artist_href in enumerate(collect_listing_hrefs(driver), start=1):
+        if artist_href in previously_scraped_pages:
+            print("Artist completed, skipping: ", artist_href)
+            continue
 
-        # And if we find it
-        if artist_element:
-            artist_href = artist_element.get_attribute("href")
-            if artist_href in previously_scraped_pages:
-                print("Artist completed, skipping: ", artist_href)
-                continue
-            # We load it
-            if click_safe(artist_element):
-                # And attempt to load each of their songs
-                scrape_artist_songs()
-                # When we are done with this artist, we navigate back and continue.
-                driver.back()
-                add_scraped_page(artist_href)
+        # We load their songs, and attempt to load each of those
+        driver.get(artist_href)
+        scrape_artist_songs(driver, session)
+        add_scraped_page(artist_href)
 
         if i % 5 == 0:
             print(f"{i} artists scraped, analysis:")
@@ -435,25 +664,326 @@ def scrape_artists() -> None:
             print()
 
 
-def iterate_artists_for_prefix() -> None:
+def iterate_artists_for_prefix(driver, session: Union[requests.Session, None] = None) -> None:
     """
-    Runs scrape_artists() and when it returns, checks for a next button.
-    If we find a next button, we click it, and run scrape_artists() again.
-    If we don't find a next button, or if we fail  to click it, we return.
+    Runs scrape_artists() and when it returns, goes to the next page of artists.
+    We find the next button before scrape_artists() takes us away from the page.
+    If we don't find a next button (or it's for the page we're on), we return.
     """
 
     while True:
         global previously_scraped_pages
         previously_scraped_pages = get_all_scraped_pages()
 
-        scrape_artists()
+        next_button = find_xpath_safe(driver, "//*[@class='paging']//a[last()]")
+        next_href = next_button.get_attribute("href") if next_button else None
+        if next_href == driver.current_url:
+            next_href = None
 
-        next_button = find_xpath_safe("//*[@class='paging']//a[last()]")
-        if next_button and click_safe(next_button):
-            continue
+        scrape_artists(driver, session)
+
+        if next_href:
+            driver.get(next_href)
         else:
             print("End of alphabetical tab.")
             return
 
 
-iterate_artists_for_prefix()
+# The parallel scraper
+# The frontier table holds every href we've found but not scraped yet. Workers, each with their own
+# headless browser, claim an href at a time, scrape it, and hand what they found (songs, new hrefs,
+# and the href itself being done) to the one writer thread, which is the only thing writing it all to the db.
+# Because the frontier lives in the db, stopping and starting again picks up where we left off.
+
+# Songs first, then artists, then listings, so we finish what we've found before finding more
+PRIORITIES = {"song": 0, "artist": 1, "listing": 2}
+
+
+def claim_href(worker_con: sqlite3.Connection) -> Union[tuple[str, str], None]:
+    """
+    This claims the next href on the frontier for a worker, and returns (href, kind), or None if there isn't one
+    It's one UPDATE, so two workers can never claim the same href
+    """
+    claimed = worker_con.execute(
+        """
+        UPDATE frontier SET claimed = 1
+        WHERE href = (
+            SELECT href FROM frontier WHERE claimed = 0 ORDER BY priority LIMIT 1
+        )
+        RETURNING href, kind;
+        """
+    ).fetchall()
+    return claimed[0] if claimed else None
+
+
+def scrape_listing(driver, href: str) -> list[tuple[str, str]]:
+    """
+    A page of artists: every artist on it, and the next page, go on the frontier
+    """
+    dismiss_footer(driver)
+    links = [(artist_href, "artist") for artist_href in collect_listing_hrefs(driver)]
+    next_button = find_xpath_safe(driver, "//*[@class='paging']//a[last()]")
+    if next_button and next_button.get_attribute("href") not in (None, href):
+        links.append((next_button.get_attribute("href"), "listing"))
+    return links
+
+
+class Crawl:
+    """
+    This keeps track of the workers, so they know when there's nothing left for anyone to do
+    A worker counts as busy from before it claims an href until it's handed in what it found there
+    """
+
+    def __init__(self, results: queue.Queue, writer: threading.Thread):
+        self.results = results
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.busy = 0
+
+    def start_task(self) -> None:
+        with self.lock:
+            self.busy += 1
+
+    def finish_task(self) -> int:
+        """
+        Returns how many workers are still busy
+        """
+        with self.lock:
+            self.busy -= 1
+            return self.busy
+
+    def check_writer(self) -> None:
+        """
+        If the writer thread died, nothing we scrape gets saved, so we stop
+        """
+        if not self.writer.is_alive():
+            raise RuntimeError("The writer thread died, stopping")
+
+    def flush(self) -> None:
+        """
+        This waits for the writer to write out everything handed to it so far
+        """
+        done = threading.Event()
+        self.results.put(("flush", done))
+        while not done.wait(timeout=1):
+            self.check_writer()
+
+
+def run_worker(crawl: Crawl, headless: bool = True, fast: bool = False) -> None:
+    """
+    A worker: it claims hrefs until the frontier's empty and nobody else is busy (so nobody's about to add more),
+    scraping each one in its own browser (or its own http session, for songs, if fast) and handing the results to the writer thread
+    """
+    worker_con = sqlite3.connect(DB_FILENAME, timeout=60, isolation_level=None)
+    driver = make_driver(headless=headless)
+    session = make_session() if fast else None
+    try:
+        while True:
+            crawl.check_writer()
+            # We're busy before we claim, so nobody thinks we're all out of work while we're getting some
+            crawl.start_task()
+            claimed = claim_href(worker_con)
+            if claimed is None:
+                # Whatever other workers found might still be on its way to the db, so we make sure it's there
+                crawl.flush()
+                claimed = claim_href(worker_con)
+            if claimed is None:
+                # If nobody else is busy either, nobody's going to find any more hrefs
+                if crawl.finish_task() == 0:
+                    return
+                time.sleep(0.2)
+                continue
+
+            href, kind = claimed
+            try:
+                if kind == "song":
+                    song = scrape_song(driver, href, session)
+                    if song:
+                        crawl.results.put(("song", song))
+                elif kind == "artist":
+                    driver.get(href)
+                    songs = [(song_href, "song") for song_href in collect_listing_hrefs(driver)]
+                    crawl.results.put(("links", songs))
+                else:
+                    driver.get(href)
+                    crawl.results.put(("links", scrape_listing(driver, href)))
+                crawl.results.put(("page", href))
+            except Exception as exc:
+                # Whatever went wrong, one bad page shouldn't take the worker (and its browser) down with it.
+                # It stays claimed, so we don't keep retrying it this run; the next run will try it again
+                print("Something awful happened while scraping ", href, ": ", exc)
+            finally:
+                crawl.finish_task()
+    finally:
+        driver.quit()
+        worker_con.close()
+        if session:
+            session.close()
+
+
+def run_writer(results: queue.Queue) -> None:
+    """
+    The writer thread: the only thing that writes to the db while the workers scrape
+    It takes the workers' results off the queue and feeds them to song_writer, until it gets a None
+    """
+    while True:
+        try:
+            result = results.get(timeout=song_writer.flush_seconds)
+        except queue.Empty:
+            song_writer.flush()
+            continue
+        if result is None:
+            song_writer.flush()
+            return
+        kind, value = result
+        if kind == "song":
+            insert_song_data(**value)
+        elif kind == "links":
+            # Other workers can only claim hrefs once they're in the db, so new ones get written right away
+            song_writer.add_links(value)
+            song_writer.flush()
+        elif kind == "page":
+            add_scraped_page(value)
+        elif kind == "flush":
+            song_writer.flush()
+            value.set()
+
+
+def scrape_parallel(start_href: str, workers: int, headless: bool = True, fast: bool = False) -> None:
+    """
+    This puts start_href (a page of artists) on the frontier and scrapes everything it leads to with workers browsers
+    """
+    # Nothing is really being worked on before we start, so anything claimed by a run that died is up for grabs again
+    cur.execute("UPDATE frontier SET claimed = 0")
+    con.commit()
+    song_writer.add_links([(start_href, "listing")])
+    song_writer.flush()
+
+    results: queue.Queue = queue.Queue()
+    writer = threading.Thread(target=run_writer, args=(results,))
+    writer.start()
+    crawl = Crawl(results, writer)
+    threads = [
+        threading.Thread(target=run_worker, args=(crawl, headless, fast))
+        for _ in range(workers)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        results.put(None)
+        writer.join()
+    print("Frontier empty, all done. Analysis:")
+    pprint(analysis_chord_counts())
+
+
+# Saved pages for trying the parsing offline
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class MyTests(unittest.TestCase):
+    """
+    Run these with: python -m unittest web-scrapy.py
+    """
+
+    def song_html(self) -> str:
+        with open(os.path.join(FIXTURES, "song.html"), encoding="utf-8") as page:
+            return page.read()
+
+    def test_parse_song_html(self):
+        # The saved page has no tbody in its tables (browsers add those), so this goes thru the fallback xpaths
+        html = self.song_html()
+        assert "<tbody" not in html, "test failed, fixture has a tbody"
+        song = parse_song_html(html)
+        assert song == {
+            "artist": "Example Artist",
+            "title": "Example Song",
+            "tuning": "Drop D",
+            "chords": ["Am", "C", "G"],
+        }, "test failed, wrong song details"
+
+        # The same page with tbody in it (like the browser sees it) gives the same song
+        with_tbody = html.replace("<table width=\"100%\">", "<table width=\"100%\"><tbody>")
+        assert parse_song_html(with_tbody) == song, "test failed, tbody changed things"
+
+    def test_parse_song_html_bad_chords(self):
+        # Same as the browser: a song with a chord that isn't a chord is pooched
+        html = self.song_html().replace("<center>G</center>", "<center>h</center>")
+        assert parse_song_html(html) is None, "test failed, pooched song parsed"
+
+    def test_parse_song_html_not_a_song(self):
+        with self.assertRaises(SongParseError):
+            parse_song_html("<html><body><div id='main_content'>Not found</div></body></html>")
+
+    def test_parse_song_html_empty_page(self):
+        for html in (b"", b"   ", "<!-- nothing here -->"):
+            with self.assertRaises(SongParseError):
+                parse_song_html(html)
+
+    def test_fetch_song_details_offline(self):
+        # Saved pages can be given as a path or a file:// url
+        path = os.path.join(FIXTURES, "song.html")
+        session = make_session()
+        song = fetch_song_details(session, path)
+        assert song and song["title"] == "Example Song", "test failed, path"
+        song = fetch_song_details(session, "file://" + path)
+        assert song and song["title"] == "Example Song", "test failed, file url"
+        session.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scrapes chords from guitartabs.cc into " + DB_FILENAME)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="scrape with this many headless browsers in parallel (0, the default, is one browser going page by page)",
+    )
+    parser.add_argument("--headless", action="store_true", help="hide the browser when scraping page by page")
+    parser.add_argument(
+        "--fetch",
+        choices=["browser", "http"],
+        default="browser",
+        help="how to load song pages: http downloads them and parses them with lxml, using the browser only when that doesn't work",
+    )
+    parser.add_argument(
+        "--parse",
+        nargs="+",
+        metavar="PAGE",
+        help="just parse these saved song pages (paths or urls) without the browser, print what we find, and quit",
+    )
+    args = parser.parse_args()
+
+    if args.parse:
+        session = make_session()
+        for page in args.parse:
+            try:
+                fetch_song_details(session, page)
+            except SongParseError as exc:
+                print(page, ": ", exc)
+        return
+
+    chromedriver_autoinstaller.install()
+
+    # Dis my driver, it drives the browser.
+    driver = make_driver(headless=args.headless or args.workers > 0)
+    driver.get(START_URL)
+
+    # We click through to the first page of artists
+    link = driver.find_element(
+        By.XPATH, "//*[@id='main_content']/table[1]/tbody/tr/td[2]/div[2]/div/div/div/a[1]"
+    )
+
+    if args.workers > 0:
+        start_href = link.get_attribute("href")
+        driver.quit()
+        scrape_parallel(start_href, args.workers, fast=args.fetch == "http")
+    else:
+        link.click()
+        iterate_artists_for_prefix(driver, make_session() if args.fetch == "http" else None)
+
+
+if __name__ == "__main__":
+    main()
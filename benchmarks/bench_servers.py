@@ -0,0 +1,417 @@
+"""
+Load test for the two user APIs: 2024-06-10/server/main.py (the JSON file
+server) and 2024-06-17/main.py (the sqlite server).
+
+Each run starts the server under a throwaway local uvicorn, seeds it with
+a number of users, then has a pool of client threads (each with its own
+keep-alive connection) fire a weighted mix of reads and writes at it for a
+while. It reports p50/p95/p99 latency and requests/sec per operation, and
+the server's RSS after seeding and at the end.
+Every run is saved as JSON under benchmarks/results/, so runs on different
+backends, formats or commits can be compared later.
+
+    python benchmarks/bench_servers.py --server 06-10 --backend file journal \\
+        --users 1000 100000 --concurrency 16 --duration 20
+
+--mix sets the workload as op=weight pairs. The ops are:
+    get     look a seeded user up by id
+    find    look a seeded user up by email (06-10 only)
+    list    fetch a page of 100 users
+    update  change a seeded user's phone number
+    add     create a new user
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+DEFAULT_MIX = "get=70,find=10,list=5,update=10,add=5"
+
+
+class FileServer:
+    """
+    2024-06-10/server/main.py. Its storage backend and file format come
+    from the USERS_BACKEND and USERS_FORMAT environment variables.
+    """
+
+    name = "06-10"
+    app_dir = os.path.join(ROOT, "2024-06-10", "server")
+    ops = ("get", "find", "list", "update", "add")
+
+    def env(self, backend: str, format: str) -> dict:
+        return {"USERS_BACKEND": backend, "USERS_FORMAT": format}
+
+    def seed(self, url: str, users: list[dict]) -> list[str]:
+        conn = connect(url)
+        ids = []
+        for start in range(0, len(users), 10_000):
+            chunk = users[start : start + 10_000]
+            status, body = call(conn, "POST", "/api/users/bulk", body=chunk)
+            if status != 200:
+                raise RuntimeError(f"seeding failed with {status}: {body[:200]}")
+            ids.extend(json.loads(body)["ids"])
+        conn.close()
+        return ids
+
+    def request(self, op: str, user: dict, new_user: dict) -> tuple:
+        if op == "get":
+            return "GET", "/api/user/get", {"user_id": user["id"]}
+        if op == "find":
+            return "GET", "/api/user/get", {"user_email": user["email"]}
+        if op == "list":
+            return "GET", "/api/users/get", {"limit": 100}
+        if op == "update":
+            phone = f"555-{random.randrange(10**7):07d}"
+            params = {"user_id": user["id"], "user_phone": phone}
+            return "PATCH", "/api/user/update", params
+        return "POST", "/api/users/add", new_user
+
+
+class SqliteServer:
+    """
+    2024-06-17/main.py, on a users.db file in WAL mode.
+    """
+
+    name = "06-17"
+    app_dir = os.path.join(ROOT, "2024-06-17")
+    ops = ("get", "list", "update", "add")
+
+    def env(self, backend: str, format: str) -> dict:
+        return {"USERS_DB": "users.db"}
+
+    def seed(self, url: str, users: list[dict]) -> list[str]:
+        conn = connect(url)
+        ids = []
+        for start in range(0, len(users), 10_000):
+            chunk = users[start : start + 10_000]
+            status, body = call(conn, "POST", "/api/add/users", body=chunk)
+            if status != 200:
+                raise RuntimeError(f"seeding failed with {status}: {body[:200]}")
+            ids.extend(result["user_id"] for result in json.loads(body))
+        conn.close()
+        return ids
+
+    def request(self, op: str, user: dict, new_user: dict) -> tuple:
+        if op == "get":
+            return "GET", "/api/get/user", {"id": user["id"]}
+        if op == "list":
+            return "GET", "/api/get/all", {"limit": 100}
+        if op == "update":
+            phone = f"555-{random.randrange(10**7):07d}"
+            return "PATCH", "/api/update/user", {"id": user["id"], "phone": phone}
+        return "POST", "/api/add/user", new_user
+
+
+SERVERS = {server.name: server for server in (FileServer(), SqliteServer())}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def connect(url: str) -> http.client.HTTPConnection:
+    parts = urllib.parse.urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+
+
+def call(conn, method: str, path: str, params=None, body=None) -> tuple[int, bytes]:
+    """
+    Sends one request on a keep-alive connection and returns (status, body).
+    """
+    if params:
+        query = {key: value for key, value in params.items() if value is not None}
+        path = f"{path}?{urllib.parse.urlencode(query)}"
+    headers = {}
+    if body is not None:
+        body = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def run_threads(target, count: int) -> None:
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def rss(pid: int) -> dict | None:
+    """
+    Returns the process's current and peak resident set size in bytes,
+    from /proc, or None where there is no /proc or the process has exited.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+    except OSError:
+        return None
+    if "VmRSS" not in fields:
+        return None
+    return {
+        "rss_bytes": int(fields["VmRSS"].split()[0]) * 1024,
+        "peak_rss_bytes": int(fields["VmHWM"].split()[0]) * 1024,
+    }
+
+
+def start_server(server, workdir: str, backend: str, format: str):
+    """
+    Starts the server under uvicorn in workdir, so its data files land
+    there, and waits for it to answer. Returns (process, base url).
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--app-dir", server.app_dir]
+        + ["--port", str(port), "--log-level", "warning", "main:app"],
+        cwd=workdir,
+        env={**os.environ, **server.env(backend, format)},
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            conn = connect(url)
+            call(conn, "GET", "/metrics")
+            conn.close()
+            return process, url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"the {server.name} server never came up")
+
+
+def make_user(i: int) -> dict:
+    return {
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "phone": f"555-{i:07d}",
+        "address": f"{i} Main St",
+    }
+
+
+def parse_mix(mix: str, ops: tuple) -> dict:
+    """
+    Parses "get=70,add=5" into {op: weight}, dropping ops the server
+    doesn't have.
+    """
+    weights = {}
+    for pair in mix.split(","):
+        op, _, weight = pair.partition("=")
+        if op.strip() not in ("get", "find", "list", "update", "add"):
+            raise ValueError(f"Unknown op {op!r} in --mix")
+        if op.strip() in ops and float(weight) > 0:
+            weights[op.strip()] = float(weight)
+    if not weights:
+        raise ValueError(f"--mix has none of this server's ops: {', '.join(ops)}")
+    return weights
+
+
+def percentile(timings: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile of already sorted timings.
+    """
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+def summarize(timings: list[float], errors: int, elapsed: float) -> dict:
+    timings.sort()
+    summary = {
+        "requests": len(timings),
+        "errors": errors,
+        "requests_per_second": round(len(timings) / elapsed, 1),
+    }
+    if timings:
+        for p in (50, 95, 99):
+            summary[f"p{p}_ms"] = round(percentile(timings, p) * 1000, 3)
+        summary["max_ms"] = round(timings[-1] * 1000, 3)
+    return summary
+
+
+def drive(
+    server, url: str, users: list[dict], mix: dict, concurrency: int, duration: float
+) -> dict:
+    """
+    Runs the workload from concurrency threads for duration seconds.
+    Returns the summary for each op and for all of them together.
+    """
+    ops, weights = list(mix), list(mix.values())
+    timings = {op: [] for op in ops}
+    errors = {op: 0 for op in ops}
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def worker(thread: int) -> None:
+        rng = random.Random(thread)
+        conn = connect(url)
+        local = {op: [] for op in ops}
+        failed = {op: 0 for op in ops}
+        count = 0
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            user = users[rng.randrange(len(users))]
+            count += 1
+            # New users are numbered after the seeded ones, per thread.
+            new_user = make_user(len(users) + count * concurrency + thread)
+            method, path, params = server.request(op, user, new_user)
+            start = time.perf_counter()
+            try:
+                status, _ = call(conn, method, path, params)
+            except (OSError, http.client.HTTPException):
+                status = None
+                conn.close()
+                conn = connect(url)
+            if status == 200:
+                local[op].append(time.perf_counter() - start)
+            else:
+                failed[op] += 1
+        conn.close()
+        with lock:
+            for op in ops:
+                timings[op].extend(local[op])
+                errors[op] += failed[op]
+
+    start = time.perf_counter()
+    run_threads(worker, concurrency)
+    elapsed = time.perf_counter() - start
+    results = {op: summarize(timings[op], errors[op], elapsed) for op in ops}
+    results["total"] = summarize(
+        [t for op in ops for t in timings[op]], sum(errors.values()), elapsed
+    )
+    return results
+
+
+def run(server, backend: str, format: str, users: int, args) -> dict:
+    mix = parse_mix(args.mix, server.ops)
+    seed_users = [make_user(i) for i in range(users)]
+    with tempfile.TemporaryDirectory() as workdir:
+        process, url = start_server(server, workdir, backend, format)
+        try:
+            start = time.perf_counter()
+            ids = server.seed(url, seed_users)
+            seed_seconds = time.perf_counter() - start
+            for user, user_id in zip(seed_users, ids):
+                user["id"] = user_id
+            rss_seeded = rss(process.pid)
+            ops = drive(server, url, seed_users, mix, args.concurrency, args.duration)
+            rss_end = rss(process.pid)
+            # Set if the server died during the run.
+            exit_code = process.poll()
+        finally:
+            process.terminate()
+            process.wait()
+    return {
+        "server": server.name,
+        "backend": backend,
+        "format": format,
+        "users": users,
+        "concurrency": args.concurrency,
+        "duration_seconds": args.duration,
+        "mix": mix,
+        "seed_seconds": round(seed_seconds, 3),
+        "rss_after_seed": rss_seeded,
+        "rss_at_end": rss_end,
+        "server_exit_code": exit_code,
+        "ops": ops,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commit": git_commit(),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result: dict) -> None:
+    memory = result["rss_at_end"] or {}
+    if result["server_exit_code"] is not None:
+        print(f"\nThe server exited with {result['server_exit_code']} during the run")
+    print(
+        f"\n{result['server']} {result['backend']}"
+        f"{' ' + result['format'] if result['format'] else ''}, "
+        f"{result['users']} users, concurrency {result['concurrency']}, "
+        f"seeded in {result['seed_seconds']:.1f}s, "
+        f"peak RSS {memory.get('peak_rss_bytes', 0) / 2**20:.0f} MiB"
+    )
+    print(
+        f"{'op':<8} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for op, summary in result["ops"].items():
+        print(
+            f"{op:<8} {summary['requests']:>9} {summary['errors']:>7} "
+            f"{summary['requests_per_second']:>9.1f} "
+            f"{summary.get('p50_ms', 0):>8.2f} {summary.get('p95_ms', 0):>8.2f} "
+            f"{summary.get('p99_ms', 0):>8.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument(
+        "--backend", nargs="+", default=["file"], help="06-10 storage backends"
+    )
+    parser.add_argument(
+        "--format", nargs="+", default=["json-pretty"], help="06-10 file formats"
+    )
+    parser.add_argument("--users", nargs="+", type=int, default=[1000])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--output", help="where to save the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.server:
+        server = SERVERS[name]
+        # The sqlite server has no backends or formats to vary.
+        backends = args.backend if name == "06-10" else ["sqlite"]
+        formats = args.format if name == "06-10" else [None]
+        for backend in backends:
+            for format in formats:
+                for users in args.users:
+                    result = run(server, backend, format, users, args)
+                    report(result)
+                    results.append(result)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS, f"bench-{stamp}.json")
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"\nSaved to {output}")
+
+
+if __name__ == "__main__":
+    main()